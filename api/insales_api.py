@@ -1,11 +1,14 @@
-import time
 from enum import Enum
 import requests
 import json
+from api.rate_governor import RateGovernor
+from api.transport import get_transport
 
 
 REQUEST_TIMEOUT = 20
-REQUESTS_EXCEEDED_TIME_TO_SLEEP = 30
+RATE_LIMIT = 500  # requests per RATE_LIMIT_PERIOD
+RATE_LIMIT_PERIOD = 300  # sec
+RATE_LIMIT_RESERVE = 25  # 5% of the limit is left untouched
 results_per_page = 500
 orders_per_page = 100
 
@@ -34,17 +37,19 @@ one_client = '/admin/clients/'
 reviews = '/admin/reviews.json'
 
 
+governor = RateGovernor('Insales', capacity=RATE_LIMIT, period=RATE_LIMIT_PERIOD, reserve=RATE_LIMIT_RESERVE)
+
+
 def wait(func):
     def wrapper(*args, **kwargs) -> requests.Response:
+        governor.acquire()
         return_value = func(*args, **kwargs)
         if return_value:
-            remaining_limits = return_value.headers.get('api-usage-limit')
-            print(f'Remaining limits: {remaining_limits if remaining_limits else 'Not found'}')
-            if remaining_limits:
-                remain, capacity = remaining_limits.split('/')
-                if int(remain) / int(capacity) > 0.95:
-                    print(f'Exceeded limits, waiting {REQUESTS_EXCEEDED_TIME_TO_SLEEP} sec...')
-                    time.sleep(REQUESTS_EXCEEDED_TIME_TO_SLEEP)
+            usage_limit = return_value.headers.get('api-usage-limit')  # used/capacity
+            if usage_limit:
+                used, capacity = usage_limit.split('/')
+                governor.update(remaining=int(capacity) - int(used), limit=int(capacity))
+            print(f'Remaining limits: {usage_limit if usage_limit else 'Not found'} | {governor}')
             return return_value
     return wrapper
 
@@ -54,6 +59,7 @@ class Insales:
 
     def __init__(self, main_url):
         self.main_url = main_url + '/admin'
+        self.transport = get_transport(self.main_url, timeout=REQUEST_TIMEOUT)
 
     @wait
     def make_request(self, method: Method, route: str, params=None, data=None) -> requests.Response:
@@ -63,10 +69,10 @@ class Insales:
             data = {}
         url = self.main_url + route
         match method:
-            case Method.GET: r = requests.get(url=url, headers=self.headers, params=params, timeout=REQUEST_TIMEOUT)
-            case Method.PUT: r = requests.put(url=url, headers=self.headers, params=params, data=data, timeout=REQUEST_TIMEOUT)
-            case Method.POST: r = requests.post(url=url, headers=self.headers, params=params, data=data, timeout=REQUEST_TIMEOUT)
-            case Method.DELETE: r = requests.delete(url=url, headers=self.headers, params=params, data=data, timeout=REQUEST_TIMEOUT)
+            case Method.GET: r = self.transport.get(url=url, headers=self.headers, params=params, timeout=REQUEST_TIMEOUT)
+            case Method.PUT: r = self.transport.put(url=url, headers=self.headers, params=params, data=data, timeout=REQUEST_TIMEOUT)
+            case Method.POST: r = self.transport.post(url=url, headers=self.headers, params=params, data=data, timeout=REQUEST_TIMEOUT)
+            case Method.DELETE: r = self.transport.delete(url=url, headers=self.headers, params=params, data=data, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
         return r
 
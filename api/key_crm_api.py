@@ -1,10 +1,21 @@
-import time
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
 
 import requests
 from enum import StrEnum
+from pathlib import Path
+from api.shared_quota import Priority, SharedRateGovernor
+from api.transport import get_transport
 
 REQUEST_TIMEOUT = 20
-REQUESTS_EXCEEDED_TIME_TO_SLEEP = 10
+RATE_LIMIT_PER_MINUTE = 60
+RATE_LIMIT_RESERVE = 5
+RATE_LIMIT_LOW_PRIORITY_RESERVE = 15  # left by bulk sweeps for order creation and regular sync
+QUOTA_DB_FILE = Path(tempfile.gettempdir()) / 'keycrm_quota.sqlite3'  # one budget for all processes of the host
+MAX_PAGES_IN_FLIGHT = 4
+POOL_SIZE = 10
 results_per_page = 50
 include_order_fields = 'buyer,manager,products.offer,shipping.deliveryService,custom_fields,payments'
 
@@ -22,47 +33,70 @@ class Route(StrEnum):
     OFFERS = '/offers'
 
 
+governor = SharedRateGovernor('KeyCRM', capacity=RATE_LIMIT_PER_MINUTE, period=60, db_file=QUOTA_DB_FILE,
+                              reserve=RATE_LIMIT_RESERVE, low_priority_reserve=RATE_LIMIT_LOW_PRIORITY_RESERVE)
+
+
 class KeyCRM:
     main_url = 'https://openapi.keycrm.app/v1'
-    def __init__(self, api_key):
+    def __init__(self, api_key, priority: Priority = Priority.NORMAL):
         self.headers = {'Content-type': 'application/json',
                         'Accept': 'application/json',
                         'Cache-Control': 'no-cache',
                         'Pragma': 'no-cache',
                         'Authorization': f'Bearer {api_key}'
                         }
+        self.governor = governor
+        self.priority = priority
+        self.transport = get_transport(self.main_url, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT)
 
     def parce_validate_response(self, r: requests.Response) -> dict:
         # r.raise_for_status()
         remaining_limits = r.headers.get('X-Ratelimit-Remaining')
-        print(f'Remaining limits: {remaining_limits if remaining_limits else 'Not found'}')
         if remaining_limits:
-            if int(remaining_limits) < 20:
-                print(f'Exceeded limits, waiting {REQUESTS_EXCEEDED_TIME_TO_SLEEP} sec...')
-                time.sleep(REQUESTS_EXCEEDED_TIME_TO_SLEEP)
+            limit = r.headers.get('X-Ratelimit-Limit')
+            self.governor.update(remaining=int(remaining_limits), limit=int(limit) if limit else None)
+        print(f'Remaining limits: {remaining_limits if remaining_limits else 'Not found'} | {self.governor}')
         return r.json()
 
     def make_request(self, method: Method, route: str, params=None, json_data=None) -> dict:
+        self.governor.acquire(self.priority)
         url = self.main_url + route
         match method:
             case Method.GET:
-                r = requests.get(url=url, headers=self.headers, params=params, timeout=REQUEST_TIMEOUT)
+                r = self.transport.get(url=url, headers=self.headers, params=params, timeout=REQUEST_TIMEOUT)
             case Method.PUT:
-                r = requests.put(url=url, headers=self.headers, json=json_data, timeout=REQUEST_TIMEOUT)
+                r = self.transport.put(url=url, headers=self.headers, json=json_data, timeout=REQUEST_TIMEOUT)
             case Method.POST:
-                r = requests.post(url=url, headers=self.headers, json=json_data, timeout=REQUEST_TIMEOUT)
+                r = self.transport.post(url=url, headers=self.headers, json=json_data, timeout=REQUEST_TIMEOUT)
             case _:
                 raise Exception('Unknown method')
 
         return self.parce_validate_response(r)
 
-    def get_orders(self, last_orders_amount=results_per_page, filter: dict = None) -> list[dict]:
+    def get_orders(self, last_orders_amount=results_per_page, filter: dict = None,
+                   max_in_flight: int = MAX_PAGES_IN_FLIGHT) -> list[dict]:
         """
         Returns list of orders dicts
         :param last_orders_amount: 0 meens ALL
         :param filter: dictionary of filters
+        :param max_in_flight: how many pages are requested at the same time
         :return: list of orders dicts
         """
+        orders = []
+        for page_orders in self.iter_order_pages(last_orders_amount, filter, max_in_flight):
+            orders += page_orders
+        return orders
+
+    def iter_order_pages(self, last_orders_amount=results_per_page, filter: dict = None,
+                         max_in_flight: int = MAX_PAGES_IN_FLIGHT) -> Iterator[list[dict]]:
+        """
+        Yields orders page by page in page order.
+        Page 1 is yielded as soon as it is received, the rest are fetched in parallel, at most max_in_flight at a time.
+        :param last_orders_amount: 0 meens ALL
+        :param filter: dictionary of filters
+        :param max_in_flight: how many pages are requested at the same time
+        """
         params = {'limit': results_per_page,
                   'include': include_order_fields,
                   }
@@ -76,17 +110,33 @@ class KeyCRM:
         if last_orders_amount == 0:
             pages = data['last_page']
         else:
-            pages = last_orders_amount // results_per_page + (last_orders_amount % results_per_page > 0)
-
-        orders = data['data']
-        if pages == 1:  # all orders on one page, no need to fetch more pages
-            return orders
-        else:
-            for page in range(2, pages + 1):
-                params['page'] = page
-                data = self.make_request(Method.GET, Route.ORDER, params=params)
-                orders += data['data']
-            return orders
+            pages = min(data['last_page'],
+                        last_orders_amount // results_per_page + (last_orders_amount % results_per_page > 0))
+
+        if pages <= 1:  # all orders on one page, no need to fetch more pages
+            yield data['data']
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        try:
+            in_flight = deque()
+            next_pages = iter(range(2, pages + 1))
+
+            def submit_next_page() -> None:
+                page = next(next_pages, None)
+                if page is not None:
+                    in_flight.append(executor.submit(self.make_request, Method.GET, Route.ORDER,
+                                                     params={**params, 'page': page}))
+
+            for _ in range(max_in_flight):
+                submit_next_page()
+            yield data['data']  # processed by the caller while the next pages are in flight
+            while in_flight:
+                page_data = in_flight.popleft().result()['data']
+                submit_next_page()
+                yield page_data
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
     def get_order(self, order_id: int | str) -> dict:
         return self.make_request(Method.GET, f'{Route.ORDER}/{order_id}', params={'include': include_order_fields})
@@ -107,10 +157,16 @@ class KeyCRM:
         return self.make_request(Method.GET, Route.OFFERS, params={'limit': results_per_page,
                                                                          'include': 'product'})
 
-    def get_order_by_source_uuid(self, source_uuid: str) -> dict:
-        orders = self.get_orders(last_orders_amount=1000)
-        for order in orders:
-            if str(order['source_uuid']) == str(source_uuid):
-                return order
+    def get_order_by_source_uuid(self, source_uuid: int | str,
+                                 include: Optional[str] = include_order_fields) -> Optional[dict]:
+        """
+        Returns the order with source_uuid or None, filtered on the CRM side.
+        :param include: related entities to include, None for the bare order
+        """
+        params = {'limit': 1, 'filter[source_uuid]': str(source_uuid)}
+        if include:
+            params['include'] = include
+        orders = self.make_request(Method.GET, Route.ORDER, params=params)['data']
+        return orders[0] if orders else None
 
 
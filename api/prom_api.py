@@ -1,5 +1,6 @@
 import requests
 import json
+from api.transport import get_transport
 
 REQUEST_TIMEOUT = 20
 results_per_page = 50
@@ -15,16 +16,17 @@ class PromClient:
             'Authorization': f'Bearer {self.token}',
             'Content-type': 'application/json'
         }
+        self.transport = get_transport(main_url, timeout=REQUEST_TIMEOUT)
 
     def make_request(self, url, method='GET', data=None) -> requests.Response:
         url = f'{main_url}{url}'
         # print(data)
         if method == 'GET':
-            r = requests.get(url=url, headers=self.headers)
+            r = self.transport.get(url=url, headers=self.headers)
         elif method == 'POST':
-            r = requests.post(url=url, data=data, headers=self.headers)
+            r = self.transport.post(url=url, data=data, headers=self.headers)
         elif method == 'PUT':
-            r = requests.put(url=url, data=data, headers=self.headers)
+            r = self.transport.put(url=url, data=data, headers=self.headers)
         else:
             raise Exception('Unknown method')
         # print('status_code=', r.status_code)
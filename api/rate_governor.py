@@ -0,0 +1,75 @@
+import threading
+import time
+from typing import Optional
+
+
+class RateGovernor:
+    """
+    Token bucket of one API rate limit, kept in sync with the limit headers of the API replies.
+
+    The bucket refills evenly at capacity / period tokens per second, so when the headroom is gone requests
+    are paced at the rate the API restores its limit instead of stalling for a fixed time.
+    Callers wait in acquire() until a token is available.
+    """
+
+    def __init__(self, name: str, capacity: int, period: float, reserve: int = 0):
+        """
+        :param name: API name for logs
+        :param capacity: requests allowed per period
+        :param period: limit window, sec
+        :param reserve: tokens left untouched, for other clients of the same API key
+        """
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+        self.reserve = reserve
+        self._tokens = float(capacity - reserve)
+        self._updated_at = time.monotonic()
+        self._condition = threading.Condition()
+        self.waiting = 0
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity - self.reserve, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self) -> float:
+        """
+        Takes one token, waiting for it if necessary.
+        :return: seconds waited
+        """
+        start = time.monotonic()
+        with self._condition:
+            self.waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return time.monotonic() - start
+                    self._condition.wait((1 - self._tokens) / self.rate)
+            finally:
+                self.waiting -= 1
+
+    def update(self, remaining: int, limit: Optional[int] = None) -> None:
+        """Corrects the bucket with the limit state reported by the API."""
+        with self._condition:
+            if limit:
+                self.capacity = limit
+            self._refill()
+            self._tokens = min(self._tokens, remaining - self.reserve)
+            self._condition.notify_all()
+
+    @property
+    def headroom(self) -> float:
+        """Share of the limit available right now, 0..1."""
+        with self._condition:
+            self._refill()
+            return max(0.0, self._tokens) / max(1, self.capacity - self.reserve)
+
+    def __repr__(self):
+        return f'{self.name}: headroom {self.headroom:.0%}, {self.waiting} waiting'
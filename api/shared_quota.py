@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from pathlib import Path
+from typing import Optional
+
+MIN_POLL = 0.05  # sec
+MAX_POLL = 1  # sec, high priority waiters renew their claim this often
+HIGH_PRIORITY_CLAIM_TTL = 3 * MAX_POLL  # a claim of a crashed process expires by itself
+
+
+class Priority(IntEnum):
+    LOW = 0  # bulk sweeps
+    NORMAL = 1
+    HIGH = 2  # new orders creation
+
+
+class SharedRateGovernor:
+    """
+    Token bucket of one API key shared by all processes of the host.
+    The bucket lives in a SQLite file, every acquire/update is one short BEGIN IMMEDIATE transaction.
+
+    LOW priority callers leave low_priority_reserve tokens untouched.
+    While a HIGH priority caller waits, NORMAL and LOW ones don't take tokens at all.
+    """
+
+    def __init__(self, name: str, capacity: int, period: float, db_file: Path | str, reserve: int = 0,
+                 low_priority_reserve: int = 0):
+        """
+        :param name: API name, one bucket per name
+        :param capacity: requests allowed per period
+        :param period: limit window, sec
+        :param db_file: SQLite file with the buckets
+        :param reserve: tokens nobody takes (safety margin to the real limit)
+        :param low_priority_reserve: tokens LOW priority callers leave to the others
+        """
+        self.name = name
+        self.period = period
+        self.reserve = reserve
+        self.low_priority_reserve = low_priority_reserve
+        self.db_file = str(db_file)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL, '
+                     'capacity INTEGER, high_priority_until REAL)')
+        conn.execute('INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?, 0)',
+                     (name, capacity - reserve, time.time(), capacity))
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _bucket(self):
+        """Locks the bucket for all processes and yields its refilled state; changes are saved on exit."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            tokens, updated_at, capacity, high_priority_until = conn.execute(
+                'SELECT tokens, updated_at, capacity, high_priority_until FROM buckets WHERE name = ?', (self.name,)
+            ).fetchone()
+            now = time.time()
+            bucket = {
+                'tokens': self._refilled(tokens, updated_at, capacity, now),
+                'capacity': capacity,
+                'high_priority_until': high_priority_until,
+                'now': now,
+            }
+            yield bucket
+            conn.execute('UPDATE buckets SET tokens = ?, updated_at = ?, capacity = ?, high_priority_until = ? '
+                         'WHERE name = ?',
+                         (bucket['tokens'], now, bucket['capacity'], bucket['high_priority_until'], self.name))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _refilled(self, tokens: float, updated_at: float, capacity: int, now: float) -> float:
+        return min(capacity - self.reserve, tokens + max(0.0, now - updated_at) * capacity / self.period)
+
+    def acquire(self, priority: Priority = Priority.NORMAL) -> float:
+        """
+        Takes one token, waiting for it if necessary.
+        :return: seconds waited
+        """
+        start = time.monotonic()
+        need = 1 + (self.low_priority_reserve if priority == Priority.LOW else 0)
+        while True:
+            with self._bucket() as bucket:
+                if priority == Priority.HIGH:
+                    bucket['high_priority_until'] = bucket['now'] + HIGH_PRIORITY_CLAIM_TTL
+                    high_priority_waits = False
+                else:
+                    high_priority_waits = bucket['now'] < bucket['high_priority_until']
+                if not high_priority_waits and bucket['tokens'] >= need:
+                    bucket['tokens'] -= 1
+                    if priority == Priority.HIGH:
+                        bucket['high_priority_until'] = 0
+                    return time.monotonic() - start
+                delay = (need - bucket['tokens']) * self.period / bucket['capacity']
+            time.sleep(min(max(delay, MIN_POLL), MAX_POLL))
+
+    def update(self, remaining: int, limit: Optional[int] = None) -> None:
+        """Corrects the bucket with the limit state reported by the API."""
+        with self._bucket() as bucket:
+            if limit:
+                bucket['capacity'] = limit
+            bucket['tokens'] = min(bucket['tokens'], remaining - self.reserve)
+
+    @property
+    def headroom(self) -> float:
+        """Share of the limit available right now, 0..1. A plain read, the bucket is neither locked nor saved."""
+        tokens, updated_at, capacity = self._connection().execute(
+            'SELECT tokens, updated_at, capacity FROM buckets WHERE name = ?', (self.name,)
+        ).fetchone()
+        tokens = self._refilled(tokens, updated_at, capacity, time.time())
+        return max(0.0, tokens) / max(1, capacity - self.reserve)
+
+    def __repr__(self):
+        return f'{self.name}: shared headroom {self.headroom:.0%}'
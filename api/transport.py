@@ -0,0 +1,66 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 20
+
+_transports: dict[str, 'Transport'] = {}
+_transports_lock = threading.Lock()
+
+
+class Transport:
+    """
+    Keep-alive connection pool to one host.
+    The pool (HTTPAdapter) is shared by all threads, every thread gets its own requests.Session on top of it,
+    so the clients stay thread safe under waitress worker threads and thread pools.
+    Cookies are not kept: the APIs are stateless and a shared session must not leak state between calls.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+
+def get_transport(url: str, pool_size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT) -> Transport:
+    """
+    Returns the transport of the url host, creating it on first use.
+    pool_size and timeout of the first caller win for the host.
+    """
+    parts = urlsplit(url)
+    host = f'{parts.scheme}://{parts.netloc}'
+    with _transports_lock:
+        if host not in _transports:
+            _transports[host] = Transport(pool_size=pool_size, timeout=timeout)
+        return _transports[host]
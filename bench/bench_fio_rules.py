@@ -0,0 +1,118 @@
+"""
+Benchmark of parse.fio_rules on a sample of buyer names as they come from CRM:
+share of the names reordered locally (AI calls avoided), correctness of the local answers and speed.
+The first sample is built of the words the rules know, the second one of given names and surnames missing from
+the rule dictionaries and of given names followed by ordinary words, it shows how the rules generalize.
+
+Run from the repository root: python -m bench.bench_fio_rules
+"""
+import random
+import time
+
+from parse.fio_rules import MIN_CONFIDENCE, score_fio
+
+SAMPLE_SIZE = 20_000
+
+MALE = [('Олександр', 'Олександрович', 'Олександрівна'), ('Іван', 'Іванович', 'Іванівна'),
+        ('Сергій', 'Сергійович', 'Сергіївна'), ('Андрій', 'Андрійович', 'Андріївна'),
+        ('Петро', 'Петрович', 'Петрівна'), ('Микола', 'Миколайович', 'Миколаївна'),
+        ('Сергей', 'Сергеевич', 'Сергеевна'), ('Владимир', 'Владимирович', 'Владимировна'),
+        ('Юрій', 'Юрійович', 'Юріївна'), ('Василь', 'Васильович', 'Василівна')]
+FEMALE = ['Олена', 'Тетяна', 'Наталія', 'Ірина', 'Оксана', 'Світлана', 'Юлія', 'Марина', 'Елена', 'Мар\'яна']
+SURNAMES = [('Шевченко', 'Шевченко'), ('Коваленко', 'Коваленко'), ('Бондаренко', 'Бондаренко'),
+            ('Ковальчук', 'Ковальчук'), ('Мельник', 'Мельник'), ('Кравчук', 'Кравчук'), ('Ткачук', 'Ткачук'),
+            ('Іванов', 'Іванова'), ('Петров', 'Петрова'), ('Лисенко', 'Лисенко'), ('Савчук', 'Савчук'),
+            ('Гончар', 'Гончар'), ('Коваль', 'Коваль'), ('Поліщук', 'Поліщук'), ('Марченко', 'Марченко'),
+            ('Руденко', 'Руденко'), ('Кузнецов', 'Кузнецова'), ('Ярошевич', 'Ярошевич'), ('Дуб', 'Дуб'),
+            ('Вовк', 'Вовк'), ('Олійник', 'Олійник'), ('Захарчишин', 'Захарчишин')]
+NOT_NAMES = ['Нова Пошта', 'ФОП Коваленко', 'Салон краси Афродіта', 'ТОВ Ромашка', 'Barber Shop', 'Olena Petrenko',
+             'Олена', 'Петренко Олена Іванівна 0671234567', 'Іван з Харкова', 'Для Олени']
+
+# not in parse.fio_rules dictionaries
+OUTSIDE_MALE = ['Любомир', 'Богуслав', 'Зорян', 'Северин', 'Ігнат', 'Тихон', 'Добромир', 'Ярема']
+OUTSIDE_FEMALE = ['Устина', 'Роксолана', 'Ельвіра', 'Мілена', 'Орися', 'Дзвенислава', 'Ярина', 'Любава']
+OUTSIDE_SURNAMES = [('Гаврилюк', 'Гаврилюк'), ('Стасюк', 'Стасюк'), ('Дзюба', 'Дзюба'), ('Сорока', 'Сорока'),
+                    ('Гуз', 'Гуз'), ('Бех', 'Бех'), ('Ґудзь', 'Ґудзь'), ('Стефанишин', 'Стефанишин'),
+                    ('Семенов', 'Семенова'), ('Жулинський', 'Жулинська'), ('Пилипенко', 'Пилипенко'),
+                    ('Ворона', 'Ворона'), ('Цап', 'Цап'), ('Яремчук', 'Яремчук')]
+NOT_SURNAMES = ['Магазин', 'Пошта', 'Доставка', 'Квіти', 'Склад', 'Офіс', 'Самовивіз', 'Каса', 'Аптека', 'Львів',
+                'Подарунок', 'Салон', 'Замовлення', 'Кур\'єр']
+
+
+def sample_names(size: int, seed: int = 1) -> list[tuple[str, str | None]]:
+    """(raw name, expected reordered name or None if the name is not 'Прізвище Ім'я [По батькові]')"""
+    rnd = random.Random(seed)
+    result = []
+    for _ in range(size):
+        if rnd.random() < 0.1:
+            result.append((rnd.choice(NOT_NAMES), None))
+            continue
+        male_surname, female_surname = rnd.choice(SURNAMES)
+        if rnd.random() < 0.5:
+            name, surname = rnd.choice(MALE)[0], male_surname
+            patronymic = rnd.choice(MALE)[1]
+        else:
+            name, surname = rnd.choice(FEMALE), female_surname
+            patronymic = rnd.choice(MALE)[2]
+        words = [surname, name, patronymic] if rnd.random() < 0.7 else [surname, name]
+        expected = ' '.join(words)
+        raw = words[:]
+        shuffle = rnd.random()
+        if shuffle < 0.4:
+            raw = raw[1:] + raw[:1]  # Ім'я По батькові Прізвище - the most frequent wrong order
+        elif shuffle < 0.5:
+            rnd.shuffle(raw)
+        if rnd.random() < 0.1:
+            raw = [word.lower() for word in raw]
+        result.append((' '.join(raw), expected))
+    return result
+
+
+def sample_outside_names(size: int, seed: int = 2) -> list[tuple[str, str | None]]:
+    """Names outside the rule dictionaries and given names with ordinary words, same format as sample_names."""
+    rnd = random.Random(seed)
+    result = []
+    for _ in range(size):
+        is_male = rnd.random() < 0.5
+        name = rnd.choice(OUTSIDE_MALE + [male[0] for male in MALE] if is_male else OUTSIDE_FEMALE + FEMALE)
+        if rnd.random() < 0.3:
+            words = [name, rnd.choice(NOT_SURNAMES)]
+            rnd.shuffle(words)
+            result.append((' '.join(words), None))
+            continue
+        male_surname, female_surname = rnd.choice(OUTSIDE_SURNAMES)
+        words = [male_surname if is_male else female_surname, name]
+        expected = ' '.join(words)
+        if rnd.random() < 0.5:
+            words.reverse()
+        result.append((' '.join(words), expected))
+    return result
+
+
+def report(title: str, names: list[tuple[str, str | None]]) -> None:
+    start = time.perf_counter()
+    answers = [score_fio(raw) for raw, _ in names]
+    elapsed = time.perf_counter() - start
+
+    local = wrong = 0
+    wrong_examples = set()
+    for (raw, expected), (new_fio, confidence) in zip(names, answers):
+        if confidence < MIN_CONFIDENCE:
+            continue
+        local += 1
+        if new_fio != expected:
+            wrong += 1
+            wrong_examples.add(f'{raw!r} -> {new_fio!r}, expected {expected!r}')
+    print(f'{title}: {len(names)} names, {elapsed / len(names) * 1e6:.1f} us per name')
+    for example in sorted(wrong_examples):
+        print(f'    wrong: {example}')
+    print(f'    reordered locally (AI calls avoided): {local / len(names):.1%}, wrong local answers: {wrong}')
+
+
+def main():
+    report('known words', sample_names(SAMPLE_SIZE))
+    report('outside the dictionaries', sample_outside_names(SAMPLE_SIZE))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark of the tree part of sync_crm_1c.process_orders cycle:
+unique tree products for every root order and root id for every child order.
+Compares the old per-order rebuild of orders_map/children_map with OrderForest.
+
+Run from the repository root: python -m bench.bench_order_forest
+"""
+import random
+import time
+
+from order_forest import OrderForest
+
+BATCH_SIZES = [500, 5_000, 50_000]
+LEGACY_MAX_FULL_RUN = 5_000  # bigger batches are measured on a sample and extrapolated
+LEGACY_SAMPLE = 500
+
+
+# ------------------------------------ legacy implementation ------------------------------------
+def find_all_tree_orders_any_level(order_dict: dict, crm_orders: list[dict]) -> list[dict]:
+    orders_map = {order['id']: order for order in crm_orders}
+    children_map = {}
+    for order in crm_orders:
+        children_map.setdefault(order['parent_id'], []).append(order['id'])
+
+    result = []
+    stack = [order_dict['id']]
+    while stack:
+        curr_node_id = stack.pop()
+        result.append(orders_map[curr_node_id])
+        if curr_node_id in children_map:
+            stack.extend(children_map[curr_node_id])
+    return result
+
+
+def find_unique_tree_products(tree_orders: list[dict]) -> list[dict]:
+    unique_products = []
+    skus = []
+    for order in tree_orders:
+        for product in order['products']:
+            if product['sku'] not in skus:
+                unique_products.append(product)
+                skus.append(product['sku'])
+    return unique_products
+
+
+def find_root_order_id(order_dict: dict, crm_orders: list[dict]) -> int:
+    orders_map = {order['id']: order for order in crm_orders}
+    curr_order_id = order_dict['id']
+    while True:
+        curr_order = orders_map[curr_order_id]
+        if curr_order['parent_id'] is None:
+            return curr_order['id']
+        curr_order_id = curr_order['parent_id']
+
+
+# ------------------------------------------------------------------------------------------------
+def make_orders(amount: int, seed: int = 1) -> list[dict]:
+    """Synthetic batch: trees of 1..6 orders up to 3 levels deep, 1..5 products per order."""
+    rnd = random.Random(seed)
+    orders = []
+    next_id = 1
+    while len(orders) < amount:
+        root_id = next_id
+        tree = [root_id]
+        for _ in range(min(rnd.randint(1, 6), amount - len(orders))):
+            order_id = next_id
+            next_id += 1
+            parent_id = None if order_id == root_id else rnd.choice(tree)
+            tree.append(order_id)
+            products = [{'sku': f'SKU-{rnd.randint(1, 2000)}', 'price_sold': 100, 'quantity': 1}
+                        for _ in range(rnd.randint(1, 5))]
+            orders.append({'id': order_id, 'parent_id': parent_id, 'products': products})
+    rnd.shuffle(orders)
+    return orders
+
+
+def legacy_cycle(orders: list[dict], sample: list[dict]) -> None:
+    for order_dict in sample:
+        if order_dict['parent_id'] is None:
+            find_unique_tree_products(find_all_tree_orders_any_level(order_dict, orders))
+        else:
+            find_root_order_id(order_dict, orders)
+
+
+def get_tree_products(order_id: int, forest: OrderForest) -> list[dict]:
+    """sync_crm_1c.get_tree_products without product normalization (the module can't be imported without the db)."""
+    products = []
+    skus = set()
+    for order_dict in forest.subtree(order_id):
+        for product in order_dict['products']:
+            if product['sku'] not in skus:
+                products.append(product)
+                skus.add(product['sku'])
+    return products
+
+
+def forest_cycle(orders: list[dict]) -> None:
+    forest = OrderForest(orders)
+    for order_dict in orders:
+        if order_dict['parent_id'] is None:
+            get_tree_products(order_dict['id'], forest)
+        else:
+            forest.root_of(order_dict['id'])
+
+
+def main():
+    print(f'{"orders":>8} | {"before, s":>12} | {"after, s":>10} | {"speedup":>8}')
+    for amount in BATCH_SIZES:
+        orders = make_orders(amount)
+
+        sample = orders if amount <= LEGACY_MAX_FULL_RUN else orders[:LEGACY_SAMPLE]
+        start = time.perf_counter()
+        legacy_cycle(orders, sample)
+        before = (time.perf_counter() - start) * len(orders) / len(sample)
+
+        start = time.perf_counter()
+        forest_cycle(orders)
+        after = time.perf_counter() - start
+
+        mark = '*' if len(sample) < len(orders) else ' '
+        print(f'{amount:>8} | {before:>11.3f}{mark} | {after:>10.4f} | {before / after:>7.0f}x')
+    print(f'* extrapolated from {LEGACY_SAMPLE} sampled orders')
+
+
+if __name__ == '__main__':
+    main()
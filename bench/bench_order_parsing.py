@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the per-order parse cost in sync_crm_1c.process_order.
+Before: Order1CBuyer, Order1CSupplier and Order1CSupplierUpdate are validated from the CRM dict one after another,
+every validation normalizes the order again (phones, discount, SKU catalog lookups, payments, rounding).
+After: CrmOrder is validated once, the three 1C orders are derived from it.
+
+Run from the repository root: python -m bench.bench_order_parsing
+"""
+import copy
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import parse.process_xml
+from bench.bench_sku_catalog import write_feed
+from parse.parse_key_crm_order import CrmOrder, Order1CBuyer, Order1CSupplier, Order1CSupplierUpdate
+
+CATALOG_SIZE = 5_000
+ORDERS = 2_000
+PRODUCTS_PER_ORDER = 4
+
+
+def make_order(order_id: int, rnd: random.Random) -> dict:
+    return {
+        'id': order_id,
+        'parent_id': None,
+        'source_id': 1,
+        'source_uuid': order_id * 10,
+        'status_group_id': 2,
+        'manager': {'id': 1},
+        'manager_comment': None,
+        'total_discount': 15.5,
+        'buyer': {'full_name': 'Петренко Олена Іванівна', 'phone': '067 123 45 67', 'email': None,
+                  'has_duplicates': 0},
+        'shipping': {'full_address': 'Київ, відділення 1', 'recipient_full_name': 'Петренко Олена',
+                     'recipient_phone': '0501234567', 'tracking_code': '20450000000000'},
+        'products': [{'sku': f'SKU-{rnd.randrange(CATALOG_SIZE)}', 'name': 'ТОВАР З CRM', 'price_sold': 199.99,
+                      'purchased_price': 120.0, 'quantity': rnd.choice([1, 2, 3])}
+                     for _ in range(PRODUCTS_PER_ORDER)],
+        'custom_fields': [{'name': 'Постачальник', 'value': ['Постачальник 1']},
+                          {'name': 'Номер постачальника', 'value': '12345'},
+                          {'name': 'Заказ 1С', 'value': True}],
+        'payments': [{'payment_method_id': 1, 'status': 'not_paid'}],
+    }
+
+
+def parse_before(order_dict: dict) -> tuple:
+    return Order1CBuyer(**order_dict), Order1CSupplier(**order_dict), Order1CSupplierUpdate(**order_dict)
+
+
+def parse_after(order_dict: dict) -> tuple:
+    crm_order = CrmOrder(order_dict)
+    return crm_order.to_buyer(), crm_order.to_supplier(), crm_order.to_supplier_update()
+
+
+def measure(parse, orders: list[dict], repeat: int = 3) -> float:
+    """Best of several runs, seconds per order; the parsed orders are not kept, so GC doesn't skew the runs."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for order_dict in orders:
+            parse(order_dict)
+        best = min(best, time.perf_counter() - start)
+    return best / len(orders)
+
+
+def main():
+    tmp = Path(tempfile.mkdtemp())
+    write_feed(tmp / 'feed.xml', CATALOG_SIZE)
+    parse.process_xml.sku_to_name_xml_file, parse.process_xml.sku_catalog_dir = tmp / 'feed.xml', tmp
+    rnd = random.Random(1)
+    orders = [make_order(order_id, rnd) for order_id in range(1, ORDERS + 1)]
+    originals = copy.deepcopy(orders)
+
+    for order_dict in orders:
+        for old_view, new_view in zip(parse_before(order_dict), parse_after(order_dict)):
+            assert type(old_view) is type(new_view) and old_view.model_dump() == new_view.model_dump()
+    assert orders == originals, 'CRM dicts were modified'
+
+    before = measure(parse_before, orders)
+    after = measure(parse_after, orders)
+    print(f'{ORDERS} orders, {PRODUCTS_PER_ORDER} products each, catalog of {CATALOG_SIZE} offers')
+    print(f'before: {before * 1e3:.2f} ms per order, after: {after * 1e3:.2f} ms per order, '
+          f'{before / after:.1f}x faster; 1C views identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark of SKU lookups in the product feed (parse.process_xml.get_name_and_category_by_sku).
+Before: the feed is parsed into an ElementTree and every lookup scans all offers.
+After: load_catalog streams the feed with iterparse into a dict, every lookup is one dict get.
+Store: the index is written once to the SQLite store shared by the processes, a process only opens it.
+
+Run from the repository root: python -m bench.bench_sku_catalog
+"""
+import random
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Optional
+
+import parse.process_xml
+from parse.process_xml import load_catalog
+
+OFFERS = 100_000
+LOOKUPS = 10_000
+LEGACY_LOOKUPS = 20  # full scans are slow, measured on a sample
+
+
+def write_feed(path: Path, offers: int) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<yml_catalog><shop><offers>\n')
+        for i in range(offers):
+            f.write(f'<offer id="{i}" available="true"><price>{i % 1000 + 0.99}</price>'
+                    f'<categoryId>{i % 300}</categoryId><picture>https://example.com/{i}.jpg</picture>'
+                    f'<vendorCode>SKU-{i}</vendorCode><name>Товар {i} для салону краси</name>'
+                    f'<description>Опис товару {i}, який займає місце у фіді</description></offer>\n')
+        f.write('</offers></shop></yml_catalog>\n')
+
+
+def legacy_lookup(root: ET.Element, sku: str) -> tuple[Optional[str], Optional[int]]:
+    for offer in root.findall(".//offer"):
+        sku_tag = offer.find('vendorCode')
+        name_tag = offer.find('name')
+        if sku_tag is not None and name_tag is not None:
+            if sku_tag.text.lower() == sku.lower():
+                category_tag = offer.find('categoryId')
+                category = int(category_tag.text) if category_tag is not None and category_tag.text else None
+                return name_tag.text, category
+    return None, None
+
+
+def measure_load(load, feed: Path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load(feed)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    rnd = random.Random(1)
+    skus = [f'sku-{rnd.randrange(OFFERS * 11 // 10)}' for _ in range(LOOKUPS)]  # ~10% unknown SKUs
+    with tempfile.TemporaryDirectory() as tmp:
+        feed = Path(tmp) / 'feed.xml'
+        write_feed(feed, OFFERS)
+
+        root, legacy_load, legacy_memory = measure_load(lambda path: ET.parse(path).getroot(), feed)
+        start = time.perf_counter()
+        legacy_answers = [legacy_lookup(root, sku) for sku in skus[:LEGACY_LOOKUPS]]
+        legacy_lookup_time = (time.perf_counter() - start) / LEGACY_LOOKUPS
+        del root
+
+        catalog, load_time, memory = measure_load(load_catalog, feed)
+        start = time.perf_counter()
+        answers = [catalog.get(sku.lower(), (None, None)) for sku in skus]
+        lookup_time = (time.perf_counter() - start) / LOOKUPS
+
+        parse.process_xml.sku_to_name_xml_file, parse.process_xml.sku_catalog_dir = feed, Path(tmp)
+        start = time.perf_counter()
+        parse.process_xml.build_store(feed, parse.process_xml.get_feed_state(feed))
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        parse.process_xml.get_name_and_category_by_sku(skus[0])  # a new process: finds the store and opens it
+        open_time = time.perf_counter() - start
+        start = time.perf_counter()
+        store_answers = [parse.process_xml.get_name_and_category_by_sku(sku) for sku in skus]
+        store_lookup_time = (time.perf_counter() - start) / LOOKUPS
+        parse.process_xml.connections.conn.close()
+
+    assert answers[:LEGACY_LOOKUPS] == legacy_answers
+    assert store_answers == answers
+    print(f'feed of {OFFERS} offers')
+    print(f'before: load {legacy_load:.2f} s, peak memory {legacy_memory / 2 ** 20:.0f} MB, '
+          f'{legacy_lookup_time * 1e3:.1f} ms per lookup')
+    print(f'after:  load {load_time:.2f} s, peak memory {memory / 2 ** 20:.0f} MB, '
+          f'{lookup_time * 1e6:.2f} us per lookup')
+    print(f'store:  built once in {build_time:.2f} s, opened by a process in {open_time * 1e3:.1f} ms, '
+          f'{store_lookup_time * 1e6:.1f} us per lookup')
+
+
+if __name__ == '__main__':
+    main()
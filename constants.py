@@ -14,9 +14,16 @@ IS_PRODUCTION_SERVER = True if os.getenv('IS_PRODUCTION_SERVER') == 'True' else
 CRM_API_KEY = os.getenv('KEY_CRM_API_KEY')
 CRM_GET_LAST_ORDERS = 200
 CRM_MAX_PROCESSING_ORDERS = 500
+CRM_ORDERS_PER_TRANSACTION = 100  # orders committed together, every order has its own savepoint
 CRM_MINUTES_INTERVAL_TO_CHECK = 120
+CRM_FULL_SWEEP_EVERY_MINUTES = 30  # between full CRM_MINUTES_INTERVAL_TO_CHECK sweeps only orders updated since watermark are fetched
+CRM_WATERMARK_OVERLAP_SECONDS = 180  # fetch window starts this much before the watermark (late commits in CRM)
+CRM_CLOCK_SKEW_SECONDS = 120  # fetch window ends this much after local now (CRM server clock may be ahead)
 CRM_ORDER_COMPLETED_STAGE_ID = 12
 CRM_ORDER_CANCELLED_STAGE_GROUP_ID = 6
+CRM_STAGES_CACHE_TTL = 3600  # sec
+CRM_STAGE_SWEEPS_IN_FLIGHT = 3  # stages swept at the same time by get_active_orders
+CRM_LOOKUPS_IN_FLIGHT = 4  # single order lookups sent to CRM at the same time
 
 UKRSALON_URL = os.getenv('UKRSALON_URL')
 CALLBACK_CRM_PORT = int(os.getenv('CALLBACK_CRM_PORT'))
@@ -42,7 +49,9 @@ time_to_sleep_insales_crm = 5   # sec
 time_to_sleep_crm_1c = 40   # sec
 
 jsons_out_path = Path('C:/Obmen/CRM/IN')
-jsons_archive_path = Path(os.getenv('backup_root_path')) / 'Backup_Json'
+jsons_out_mode = 'files'  # 'files' - JSON file per document, 'bundle' - JSONL bundle with a manifest per cycle (per transaction chunk on big cycles)
+jsons_archive_path = Path(os.getenv('backup_root_path')) / 'Backup_Json'  # daily YYYY-MM-DD.jsonl.gz segments
+jsons_archive_retention_days = None  # days archive segments are kept, None - forever
 
 # ================================================= PROM =============================================
 
@@ -74,3 +83,6 @@ horoshop_stop_tries_after_delay = 200  # sec
 # ================================================= AI =============================================
 OPENAI_UKRSALON_API_KEY = os.getenv('OPENAI_UKRSALON_API_KEY')
 
+FIO_AI_REQUESTS_IN_FLIGHT = 4  # AI requests sent at the same time by the FIO stage
+FIO_AI_NAMES_PER_REQUEST = 10  # buyer names sent to AI in one prompt
+FIO_AI_CYCLE_DEADLINE = 20  # sec, names not reordered by then go to 1C as they are
@@ -0,0 +1,78 @@
+from datetime import datetime
+from typing import Optional
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+from db.models import ArchivedDocumentDB
+from json_archive import ArchiveLocation, parse_file_name
+from parse.parse_constants import Document1C
+
+ACTION_DOCUMENT_TYPES = {
+    'create_buyer_order': Document1C.CLIENT_ORDER,
+    'create_supplier_order': Document1C.SUPPLIER_ORDER,
+    'update_supplier_order': Document1C.SUPPLIER_ORDER,
+    'create_postupleniye_tovarov': Document1C.POSTUPLENIYE_TOVAROV,
+    'create_return_tovarov': Document1C.RETURN_TOVAROV,
+}
+
+
+class ArchiveIndex:
+    """
+    Where every archived 1C document lies: the archived_documents table keyed by the document file name.
+    A document is either a loose file in the archive folder (segment is None) or a line of a gzip member
+    of a JsonArchive segment.
+    """
+
+    def __init__(self, session_maker: sessionmaker):
+        self._session_maker = session_maker
+
+    def add(self, documents: list[tuple[str, Optional[ArchiveLocation]]]) -> int:
+        """
+        Records documents, an already indexed file name gets the new location.
+        :param documents: (file name, location in a segment or None for a loose file)
+        :return: number of recorded documents
+        """
+        rows = []
+        for file_name, location in documents:
+            try:
+                document_file = parse_file_name(file_name)
+            except ValueError as e:
+                logger.warning(f'Document is not indexed | {str(e)}')
+                continue
+            document_type = ACTION_DOCUMENT_TYPES.get(document_file.action)
+            rows.append({
+                'file_name': file_name,
+                'key_crm_id': document_file.key_crm_id,
+                'action': document_file.action,
+                'document_type': document_type.value if document_type else None,
+                'created_at': document_file.created_at,
+                'segment': location.segment if location else None,
+                'member_offset': location.offset if location else None,
+                'line': location.line if location else None,
+            })
+        if not rows:
+            return 0
+        statement = insert(ArchivedDocumentDB).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ArchivedDocumentDB.file_name],
+            set_={column: statement.excluded[column] for column in ('segment', 'member_offset', 'line')}
+        )
+        with self._session_maker.begin() as session:
+            session.execute(statement)
+        return len(rows)
+
+    def find(self, key_crm_id: Optional[str] = None, start: Optional[datetime] = None,
+             end: Optional[datetime] = None, action: Optional[str] = None) -> list[ArchivedDocumentDB]:
+        """Documents of an order (key_crm_id with or without _oc/_fd suffix) and/or time range, oldest first."""
+        with self._session_maker() as session:
+            query = session.query(ArchivedDocumentDB)
+            if key_crm_id is not None:
+                query = query.filter(ArchivedDocumentDB.key_crm_id.in_([key_crm_id, f'{key_crm_id}_oc',
+                                                                         f'{key_crm_id}_fd']))
+            if start is not None:
+                query = query.filter(ArchivedDocumentDB.created_at >= start)
+            if end is not None:
+                query = query.filter(ArchivedDocumentDB.created_at < end)
+            if action is not None:
+                query = query.filter(ArchivedDocumentDB.action == action)
+            return query.order_by(ArchivedDocumentDB.created_at).all()
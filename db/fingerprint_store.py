@@ -0,0 +1,73 @@
+import hashlib
+import json
+from typing import Iterable, Optional
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from db.models import OrderFingerprintDB, PromOrderDB
+
+# fields of a KeyCRM order that end up in 1C documents or decide how the order is processed
+FINGERPRINT_FIELDS = ('parent_id', 'source_id', 'source_uuid', 'status_id', 'status_group_id', 'manager', 'buyer',
+                      'products', 'shipping', 'custom_fields', 'payments', 'total_discount', 'manager_comment',
+                      'updated_at')
+
+
+def order_fingerprint(order_dict: dict, prom_order: Optional[PromOrderDB] = None) -> str:
+    """
+    Hash of the order fields that matter to 1C.
+    Prom order state is included because commissions of cancelled orders depend on it.
+    """
+    data = {field: order_dict.get(field) for field in FINGERPRINT_FIELDS}
+    if prom_order is not None:
+        data['prom_order'] = (prom_order.status.value, prom_order.cpa_commission, prom_order.cpa_is_refunded,
+                              prom_order.order_commission)
+    text = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class FingerprintStore:
+    """
+    Fingerprints of successfully processed orders, kept in memory and backed by the order_fingerprints table.
+    """
+
+    def __init__(self):
+        self._fingerprints: dict[int, str] = {}
+        self._loaded_ids: set[int] = set()
+        self._unsaved: dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, session: Session, key_crm_ids: Iterable[int]) -> None:
+        """Loads fingerprints of the orders that were not looked up in the db yet."""
+        ids_to_load = set(key_crm_ids) - self._loaded_ids
+        if not ids_to_load:
+            return
+        rows = session.query(OrderFingerprintDB).filter(OrderFingerprintDB.key_crm_id.in_(ids_to_load)).all()
+        for row in rows:
+            self._fingerprints.setdefault(row.key_crm_id, row.fingerprint)
+        self._loaded_ids |= ids_to_load
+
+    def matches(self, key_crm_id: int, fingerprint: str) -> bool:
+        """Same check as is_unchanged() without counting a hit or a miss."""
+        return self._fingerprints.get(key_crm_id) == fingerprint
+
+    def is_unchanged(self, key_crm_id: int, fingerprint: str) -> bool:
+        if self.matches(key_crm_id, fingerprint):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def remember(self, key_crm_id: int, fingerprint: str) -> None:
+        self._fingerprints[key_crm_id] = fingerprint
+        self._unsaved[key_crm_id] = fingerprint
+
+    def save(self, session: Session) -> None:
+        if not self._unsaved:
+            return
+        statement = insert(OrderFingerprintDB).values(
+            [{'key_crm_id': key_crm_id, 'fingerprint': fingerprint} for key_crm_id, fingerprint in self._unsaved.items()]
+        )
+        statement = statement.on_conflict_do_update(index_elements=[OrderFingerprintDB.key_crm_id],
+                                                    set_={'fingerprint': statement.excluded.fingerprint})
+        session.execute(statement)
+        self._unsaved.clear()
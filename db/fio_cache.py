@@ -0,0 +1,66 @@
+import hashlib
+from typing import Optional
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+from db.models import FioCacheDB
+
+MAX_FIO_LENGTH = FioCacheDB.raw_fio.type.length
+
+
+def fio_cache_key(fio: str) -> str:
+    """Normalized raw FIO, the ones that don't fit the column are replaced with their sha256."""
+    key = ' '.join(fio.split()).lower()
+    if len(key) > MAX_FIO_LENGTH:
+        key = f'sha256:{hashlib.sha256(key.encode()).hexdigest()}'
+    return key
+
+
+class FioCache:
+    """
+    Results of AI names reordering keyed by the normalized raw FIO, kept in memory and in the fio_cache table.
+    An empty result means AI did not recognize proper names, it is cached as well.
+    get() raises on db errors, put() only logs them: the result is kept in memory anyway.
+    """
+
+    def __init__(self, session_maker: sessionmaker):
+        self._session_maker = session_maker
+        self._results: dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fio: str) -> Optional[str]:
+        """Returns cached AI result ('' for not recognized names) or None if the FIO was never sent to AI."""
+        key = fio_cache_key(fio)
+        if key not in self._results:
+            with self._session_maker() as session:
+                row = session.get(FioCacheDB, key)
+            if row is not None:
+                self._results[key] = row.normalized_fio
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, fio: str, normalized_fio: str) -> None:
+        key = fio_cache_key(fio)
+        self._results[key] = normalized_fio
+        if len(normalized_fio) > MAX_FIO_LENGTH:
+            return
+        statement = insert(FioCacheDB).values(raw_fio=key, normalized_fio=normalized_fio)
+        statement = statement.on_conflict_do_update(index_elements=[FioCacheDB.raw_fio],
+                                                    set_={'normalized_fio': statement.excluded.normalized_fio})
+        try:
+            with self._session_maker.begin() as session:
+                session.execute(statement)
+        except Exception as e:
+            logger.warning(f'Failed to save AI result for {fio} to the FIO cache | {str(e)}')
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def __repr__(self):
+        return f'FIO cache hits: {self.hits} misses: {self.misses} hit rate: {self.hit_rate:.0%}'
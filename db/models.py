@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, func, Boolean, DateTime, Float, Enum
+from sqlalchemy import Column, String, Integer, BigInteger, func, Boolean, DateTime, Float, Enum, Text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from parse.parse_constants import PromStatus, Document1C
@@ -40,6 +40,82 @@ class Order1CDB(Base):
                 f'TTN:{self.tracking_code} supplier_id:{self.supplier_id}')
 
 
+class OrderAncestryDB(Base):
+    __tablename__ = 'order_ancestry'
+    key_crm_id = Column(Integer, primary_key=True, autoincrement=False)
+    parent_id = Column(Integer, default=None)
+    root_id = Column(Integer, default=None)
+
+    def __repr__(self):
+        return f'key_crm_id:{self.key_crm_id} parent_id:{self.parent_id} root_id:{self.root_id}'
+
+
+class OrderFingerprintDB(Base):
+    __tablename__ = 'order_fingerprints'
+    key_crm_id = Column(Integer, primary_key=True, autoincrement=False)
+    fingerprint = Column(String(32), nullable=False)
+
+    def __repr__(self):
+        return f'key_crm_id:{self.key_crm_id} fingerprint:{self.fingerprint}'
+
+
+class SourceUuidDB(Base):
+    __tablename__ = 'crm_source_uuids'
+    source_uuid = Column(String(50), primary_key=True)
+    key_crm_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f'source_uuid:{self.source_uuid} key_crm_id:{self.key_crm_id}'
+
+
+class FioCacheDB(Base):
+    __tablename__ = 'fio_cache'
+    raw_fio = Column(String(255), primary_key=True)
+    normalized_fio = Column(String(255), nullable=False)  # empty string = AI did not recognize names
+
+    def __repr__(self):
+        return f'{self.raw_fio} -> {self.normalized_fio}'
+
+
+class SyncWatermarkDB(Base):
+    __tablename__ = 'sync_watermarks'
+    name = Column(String(50), primary_key=True)
+    updated_at = Column(DateTime(timezone=True), default=None)
+    full_sweep_at = Column(DateTime(timezone=True), default=None)
+
+    def __repr__(self):
+        return f'{self.name} updated_at:{self.updated_at} full_sweep_at:{self.full_sweep_at}'
+
+
+class ArchivedDocumentDB(Base):
+    __tablename__ = 'archived_documents'
+    file_name = Column(String(255), primary_key=True)
+    key_crm_id = Column(String(50), nullable=False, index=True)
+    action = Column(String(50), nullable=False)
+    document_type = Column(String(50))
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    segment = Column(String(50))  # None = loose file in the archive folder
+    member_offset = Column(BigInteger)
+    line = Column(Integer)
+
+    def __repr__(self):
+        location = self.file_name if self.segment is None else f'{self.segment}:{self.member_offset}:{self.line}'
+        return f'{self.key_crm_id} {self.action} {self.created_at} at {location}'
+
+
+class Json1COutbox(Base):
+    __tablename__ = 'json_1c_outbox'
+    id = Column(Integer, primary_key=True)
+    key_crm_id = Column(String(50), nullable=False)
+    action = Column(String(50), nullable=False)
+    document_type = Column(String(50))
+    document = Column(Text, nullable=False)  # serialized 1C document
+    buyer_full_name = Column(String)  # raw buyer name reordered when the file is written, None = keep as is
+
+    def __repr__(self):
+        return f'{self.id}: {self.key_crm_id} {self.action} type: {self.document_type}'
+
+
 class PromOrderDB(Base):
     __tablename__ = 'prom_orders'
     order_id = Column(Integer, primary_key=True)
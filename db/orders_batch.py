@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+from loguru import logger
+from sqlalchemy.orm import Session
+from db.models import Json1COutbox, Order1CDB, PromOrderDB
+from parse.parse_constants import Document1C
+
+
+class OrdersBatch:
+    """
+    Identity map of orders_1c and prom_orders rows for one sync cycle.
+    Rows are prefetched with a couple of IN (...) queries, lookups of prefetched keys never hit the db.
+    Must be used with a session created with expire_on_commit=False, otherwise every cached row is reloaded
+    after each commit.
+
+    Writes are grouped: transaction() runs a chunk of orders in one db transaction, order_scope() wraps
+    every order into a SAVEPOINT. New orders_1c rows and their 1C documents (json_1c_outbox rows) are inserted
+    in bulk when the chunk commits, so a document is never lost once its row exists.
+    Callbacks registered with after_commit() run only after the commit succeeded.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+        self._orders_1c: dict[tuple[str, Document1C], Optional[Order1CDB]] = {}
+        self._prom_orders: dict[int, Optional[PromOrderDB]] = {}
+        self._new_orders_1c: list[Order1CDB] = []
+        self._new_documents: list[Json1COutbox] = []
+        self._after_commit: list[Callable[[], None]] = []
+
+    def prefetch(self, key_crm_ids: Iterable[int | str], source_uuids: Iterable[int | str | None]) -> None:
+        """
+        Loads prom_orders rows for source_uuids and orders_1c rows for key_crm_ids and for commission documents
+        of found prom orders. Keys that are not found are remembered as missing.
+        """
+        source_uuids = {int(uuid) for uuid in source_uuids if uuid is not None and str(uuid).isdigit()}
+        key_crm_ids = {str(key_crm_id) for key_crm_id in key_crm_ids}
+
+        if source_uuids:
+            prom_orders = self.session.query(PromOrderDB).filter(PromOrderDB.order_id.in_(source_uuids)).all()
+            self._prom_orders.update(dict.fromkeys(source_uuids))
+            for prom_order in prom_orders:
+                self._prom_orders[prom_order.order_id] = prom_order
+                key_crm_ids.update({f'{prom_order.order_id}', f'{prom_order.order_id}_oc'})
+
+        if key_crm_ids:
+            rows = self.session.query(Order1CDB).filter(Order1CDB.key_crm_id.in_(key_crm_ids)).all()
+            for key_crm_id in key_crm_ids:
+                for document_type in Document1C:
+                    self._orders_1c.setdefault((key_crm_id, document_type), None)
+            for row in rows:
+                if row.document_type is None:  # legacy rows without a type are never looked up
+                    continue
+                if self._orders_1c.get((row.key_crm_id, row.document_type)) is None:
+                    self._orders_1c[(row.key_crm_id, row.document_type)] = row
+
+    def get_order_1c(self, key_crm_id: str, document_type: Document1C) -> Optional[Order1CDB]:
+        key = (str(key_crm_id), document_type)
+        if key not in self._orders_1c:
+            self._orders_1c[key] = (self.session.query(Order1CDB)
+                                    .filter_by(key_crm_id=key[0], document_type=document_type).first())
+        return self._orders_1c[key]
+
+    def add_order_1c(self, order_db: Order1CDB) -> None:
+        """Registers a new row, it is inserted together with the others when the transaction commits."""
+        self._new_orders_1c.append(order_db)
+        self._orders_1c[(order_db.key_crm_id, order_db.document_type)] = order_db
+
+    def add_document(self, document: Json1COutbox) -> None:
+        """Registers a 1C document, it is inserted into the outbox together with the rows of the transaction."""
+        self._new_documents.append(document)
+
+    def get_prom_order(self, order_id: int | str | None) -> Optional[PromOrderDB]:
+        if order_id is None or not str(order_id).isdigit():
+            return None
+        order_id = int(order_id)
+        if order_id not in self._prom_orders:
+            self._prom_orders[order_id] = self.session.query(PromOrderDB).filter_by(order_id=order_id).first()
+        return self._prom_orders[order_id]
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        self._after_commit.append(callback)
+
+    @contextmanager
+    def transaction(self):
+        """One db transaction for a chunk of orders. Deferred callbacks run after the commit."""
+        try:
+            with self.session.begin():
+                yield
+                if self._new_orders_1c or self._new_documents:
+                    self.session.add_all(self._new_orders_1c)
+                    self.session.add_all(self._new_documents)
+                    self.session.flush()  # one multi-row INSERT ... VALUES per table for the whole chunk
+        except Exception:
+            self._discard_since(0, 0, 0)
+            raise
+
+        callbacks, self._after_commit = self._after_commit, []
+        self._new_orders_1c, self._new_documents = [], []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f'Error in deferred after commit call | {str(e)}')
+
+    @contextmanager
+    def order_scope(self):
+        """SAVEPOINT for one order: on error only its changes, documents and deferred callbacks are dropped."""
+        marks = len(self._new_orders_1c), len(self._new_documents), len(self._after_commit)
+        try:
+            with self.session.begin_nested():
+                yield
+        except Exception:
+            self._discard_since(*marks)
+            raise
+
+    def _discard_since(self, new_orders_mark: int, new_documents_mark: int, after_commit_mark: int) -> None:
+        for order_db in self._new_orders_1c[new_orders_mark:]:
+            self._orders_1c[(order_db.key_crm_id, order_db.document_type)] = None
+        del self._new_orders_1c[new_orders_mark:]
+        del self._new_documents[new_documents_mark:]
+        del self._after_commit[after_commit_mark:]
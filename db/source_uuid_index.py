@@ -0,0 +1,57 @@
+from typing import Iterable, Optional
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from api.key_crm_api import KeyCRM
+from db.models import SourceUuidDB
+
+
+class SourceUuidIndex:
+    """
+    source_uuid -> key_crm_id of CRM orders, kept in memory and backed by the crm_source_uuids table.
+    Filled from every batch of orders the sync scripts already fetch.
+    """
+
+    def __init__(self):
+        self._key_crm_ids: dict[str, int] = {}
+
+    def add_orders(self, session: Session, crm_orders: Iterable[dict]) -> None:
+        self.add_many(session, {order['source_uuid']: order['id'] for order in crm_orders if order.get('source_uuid')})
+
+    def add(self, session: Session, source_uuid: int | str, key_crm_id: int) -> None:
+        self.add_many(session, {source_uuid: key_crm_id})
+
+    def add_many(self, session: Session, key_crm_ids: dict[int | str, int]) -> None:
+        new = {str(source_uuid): key_crm_id for source_uuid, key_crm_id in key_crm_ids.items()
+               if self._key_crm_ids.get(str(source_uuid)) != key_crm_id}
+        if not new:
+            return
+        statement = insert(SourceUuidDB).values(
+            [{'source_uuid': source_uuid, 'key_crm_id': key_crm_id} for source_uuid, key_crm_id in new.items()]
+        )
+        statement = statement.on_conflict_do_update(index_elements=[SourceUuidDB.source_uuid],
+                                                    set_={'key_crm_id': statement.excluded.key_crm_id})
+        session.execute(statement)
+        self._key_crm_ids.update(new)
+
+    def get(self, session: Session, source_uuid: int | str) -> Optional[int]:
+        return self.get_many(session, [source_uuid]).get(str(source_uuid))
+
+    def get_many(self, session: Session, source_uuids: Iterable[int | str]) -> dict[str, int]:
+        """Returns key_crm_ids of known source_uuids, unknown ones are looked up in the db with one query."""
+        source_uuids = {str(source_uuid) for source_uuid in source_uuids}
+        missing = source_uuids - self._key_crm_ids.keys()
+        if missing:
+            rows = session.query(SourceUuidDB).filter(SourceUuidDB.source_uuid.in_(missing)).all()
+            self._key_crm_ids.update({row.source_uuid: row.key_crm_id for row in rows})
+        return {source_uuid: self._key_crm_ids[source_uuid] for source_uuid in source_uuids
+                if source_uuid in self._key_crm_ids}
+
+    def resolve(self, session: Session, crm: KeyCRM, source_uuid: int | str) -> Optional[int]:
+        """Returns key_crm_id from the index, asks CRM (one small request) only for unknown source_uuids."""
+        key_crm_id = self.get(session, source_uuid)
+        if key_crm_id is None:
+            order = crm.get_order_by_source_uuid(source_uuid, include=None)
+            if order is not None:
+                key_crm_id = order['id']
+                self.add(session, source_uuid, key_crm_id)
+        return key_crm_id
@@ -0,0 +1,161 @@
+import gzip
+import json
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+from loguru import logger
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+SEGMENT_SUFFIX = '.jsonl.gz'
+LOCK_FILE = '.append.lock'
+FILE_NAME_PATTERN = re.compile(r'^(?P<key_crm_id>.+?)_(?P<action>(?:create|update)_[a-z_]+)_(?P<timestamp>\d+(?:\.\d+)?)\.json$')
+
+
+class DocumentFile(NamedTuple):
+    key_crm_id: str
+    action: str
+    created_at: datetime  # local time zone
+
+
+class ArchiveLocation(NamedTuple):
+    segment: str  # segment file name
+    offset: int  # offset of the gzip member in the segment file
+    line: int  # line of the document in the member
+
+
+def segment_name(day: date) -> str:
+    return f'{day.isoformat()}{SEGMENT_SUFFIX}'
+
+
+@contextmanager
+def process_lock(lock_file: Path):
+    """Exclusive lock of the file for all processes of the host, waits until it is taken."""
+    with open(lock_file, 'a+b') as f:
+        f.seek(0)
+        if os.name == 'nt':
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # retries for 10 sec by itself
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def archive_record(file_name: str, text: str) -> str:
+    """One line of a segment: {"file": <file name>, "document": <document as it was sent to 1C>}"""
+    return f'{{"file": {json.dumps(file_name, ensure_ascii=False)}, "document": {text}}}\n'
+
+
+class JsonArchive:
+    """
+    Archive of the documents sent to 1C in daily gzip segments: <archive_path>/YYYY-MM-DD.jsonl.gz.
+    Every append() adds one gzip member with a line per document; concatenated members are a valid gzip file,
+    so a segment reads as one JSONL stream. Segments older than retention_days are removed on rotation.
+    Appends are serialized between processes (the sync and tools/pack_json_archive.py) with a lock file.
+    """
+
+    def __init__(self, archive_path: Path, retention_days: Optional[int] = None):
+        """
+        :param archive_path: directory of the segments
+        :param retention_days: days segments are kept, None - forever
+        """
+        self.archive_path = archive_path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._current_day: Optional[date] = None
+        archive_path.mkdir(parents=True, exist_ok=True)
+
+    def append(self, files: list[tuple[str, str]], day: Optional[date] = None) -> list[ArchiveLocation]:
+        """
+        Appends documents to the segment of the day (today by default).
+        :param files: (file name, single line document text)
+        :return: location of every document
+        """
+        if not files:
+            return []
+        day = day or date.today()
+        data = gzip.compress(''.join(archive_record(file_name, text) for file_name, text in files).encode('utf-8'))
+        with self._lock:
+            if day != self._current_day:
+                self._current_day = day
+                self.remove_expired()
+            segment = self.archive_path / segment_name(day)
+            with process_lock(self.archive_path / LOCK_FILE), open(segment, 'ab') as f:
+                f.write(data)
+                f.flush()
+                offset = f.tell() - len(data)
+        return [ArchiveLocation(segment.name, offset, line) for line in range(len(files))]
+
+    def remove_expired(self) -> None:
+        if self.retention_days is None:
+            return
+        oldest = segment_name(date.today() - timedelta(days=self.retention_days))
+        for segment in self.archive_path.glob(f'*{SEGMENT_SUFFIX}'):
+            if segment.name < oldest:
+                segment.unlink(missing_ok=True)
+                logger.info(f'Removed expired JSON archive segment {segment.name}')
+
+    def read(self, location: ArchiveLocation) -> dict:
+        """Returns the archive record {'file': ..., 'document': ...} at the location."""
+        with open(self.archive_path / location.segment, 'rb') as f:
+            f.seek(location.offset)
+            with gzip.GzipFile(fileobj=f) as member:
+                for line_number, line in enumerate(member):
+                    if line_number == location.line:
+                        return json.loads(line)
+        raise LookupError(f'No document at {location}')
+
+    def iter_members(self, segment: str) -> Iterator[tuple[int, list[dict]]]:
+        """(offset, records) of every gzip member of a segment, for indexing; stops at a damaged member."""
+        data = (self.archive_path / segment).read_bytes()
+        offset = 0
+        while offset < len(data):
+            decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+            try:
+                text = decompressor.decompress(data[offset:])
+            except zlib.error as e:
+                logger.error(f'JSON archive segment {segment} is damaged at {offset} | {str(e)}')
+                return
+            if not decompressor.eof:
+                logger.error(f'JSON archive segment {segment} is cut at {offset}')
+                return
+            yield offset, [json.loads(line) for line in text.decode('utf-8').splitlines()]
+            offset = len(data) - len(decompressor.unused_data)
+
+    def iter_segment(self, segment: str) -> Iterator[dict]:
+        """All records of a segment; a member cut by a crash at the end of the segment is skipped."""
+        with gzip.open(self.archive_path / segment, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as e:
+                logger.error(f'JSON archive segment {segment} is damaged at the end | {str(e)}')
+
+
+def parse_file_name(file_name: str) -> DocumentFile:
+    """Splits a document file name '{key_crm_id}_{action}_{timestamp}.json', raises ValueError for other names."""
+    match = FILE_NAME_PATTERN.match(file_name)
+    if match is None:
+        raise ValueError(f'Not a document file name: {file_name}')
+    return DocumentFile(match['key_crm_id'], match['action'],
+                        datetime.fromtimestamp(float(match['timestamp'])).astimezone())
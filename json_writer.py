@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from enum import StrEnum
+from pathlib import Path
+from typing import Hashable, Optional
+from loguru import logger
+from db.archive_index import ArchiveIndex
+from json_archive import JsonArchive
+
+TEMP_SUFFIX = '.tmp'
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+class OutputMode(StrEnum):
+    FILES = 'files'  # a JSON file per document
+    BUNDLE = 'bundle'  # a JSONL bundle of all documents of a flush and its manifest
+
+
+class JsonWriter:
+    """
+    Writes 1C exchange files in batches.
+    Files are staged during a cycle and written by flush(): every file is written under a temporary name
+    and renamed, so 1C never sees a half-written file. Archive copies go to JsonArchive in a background thread,
+    their locations are recorded in ArchiveIndex.
+
+    In BUNDLE mode flush() writes all staged documents in staging order as one bundle_<timestamp>.jsonl
+    (a document per line) followed by bundle_<timestamp>.manifest.json with the count, the sha256 of the bundle
+    and the number of documents per type. The manifest appears last, 1C imports a bundle when it sees its manifest.
+    """
+
+    def __init__(self, out_path: Path, archive: JsonArchive, mode: OutputMode = OutputMode.FILES,
+                 index: Optional[ArchiveIndex] = None):
+        self.out_path = out_path
+        self.archive = archive
+        self.index = index
+        self.mode = OutputMode(mode)
+        self._staged: list[tuple[str, str, str]] = []
+        self._keys: dict[str, Hashable] = {}  # file name -> key of the caller, for staged files only
+        self._written_keys: list[Hashable] = []
+        self._archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='json_archive')
+        for temp_file in out_path.glob(f'*{TEMP_SUFFIX}'):  # left by a crash in the middle of a write
+            temp_file.unlink(missing_ok=True)
+
+    def stage(self, file_name: str, text: str, document_type: str, key: Optional[Hashable] = None) -> None:
+        """
+        :param file_name: name of the document file in FILES mode and in the archive
+        :param text: serialized document, single line
+        :param document_type: document action for the bundle manifest
+        :param key: caller's id of the document, returned by pop_written_keys() once the file is written
+        """
+        self._staged.append((file_name, text, document_type))
+        if key is not None:
+            self._keys[file_name] = key
+
+    @property
+    def staged_keys(self) -> set[Hashable]:
+        """Keys of the files staged and not written yet."""
+        return set(self._keys.values())
+
+    def pop_written_keys(self) -> list[Hashable]:
+        """Keys of the files written since the previous call, also after a flush that failed halfway."""
+        written_keys, self._written_keys = self._written_keys, []
+        return written_keys
+
+    def _mark_written(self, files: list[tuple[str, str, str]]) -> None:
+        for file_name, _, _ in files:
+            key = self._keys.pop(file_name, None)
+            if key is not None:
+                self._written_keys.append(key)
+
+    def _write_atomic(self, file_name: str, text: str) -> None:
+        temp_file = self.out_path / f'{file_name}{TEMP_SUFFIX}'
+        temp_file.write_bytes(text.encode('utf-8'))  # no newline translation, the bundle checksum stays valid
+        os.replace(temp_file, self.out_path / file_name)
+
+    def flush(self) -> int:
+        """
+        Writes all staged files to out_path and queues their archive copies.
+        :return: number of files written
+        """
+        staged, self._staged = self._staged, []
+        if self.mode == OutputMode.BUNDLE:
+            return self._flush_bundle(staged)
+        written = 0
+        try:
+            for file_name, text, _ in staged:
+                self._write_atomic(file_name, text)
+                written += 1
+        finally:
+            self._staged[:0] = staged[written:]  # not written files are retried by the next flush
+            self._mark_written(staged[:written])
+            if written:
+                self._archive_executor.submit(self._archive, staged[:written])
+        return written
+
+    def _flush_bundle(self, staged: list[tuple[str, str, str]]) -> int:
+        if not staged:
+            return 0
+        bundle = ''.join(f'{text}\n' for _, text, _ in staged)
+        bundle_name = f'bundle_{datetime.now().timestamp()}'
+        manifest = {
+            'bundle': f'{bundle_name}.jsonl',
+            'count': len(staged),
+            'sha256': hashlib.sha256(bundle.encode('utf-8')).hexdigest(),
+            'document_types': Counter(document_type for _, _, document_type in staged),
+            'files': [file_name for file_name, _, _ in staged],
+        }
+        try:
+            self._write_atomic(f'{bundle_name}.jsonl', bundle)
+            self._write_atomic(f'{bundle_name}{MANIFEST_SUFFIX}', json.dumps(manifest, ensure_ascii=False))
+        except Exception:
+            self._staged[:0] = staged  # the whole bundle is retried by the next flush
+            raise
+        self._mark_written(staged)
+        self._archive_executor.submit(self._archive, staged)
+        logger.info(f'Created JSON bundle: {bundle_name} with {len(staged)} documents')
+        return len(staged)
+
+    def _archive(self, files: list[tuple[str, str, str]]) -> None:
+        try:
+            locations = self.archive.append([(file_name, text) for file_name, text, _ in files])
+        except Exception as e:
+            logger.error(f'Failed to archive {len(files)} JSON files: {files[0][0]}... | {str(e)}')
+            return
+        if self.index is not None:
+            try:
+                self.index.add([(file_name, location) for (file_name, _, _), location in zip(files, locations)])
+            except Exception as e:
+                logger.error(f'Failed to index {len(files)} archived JSON files: {files[0][0]}... | {str(e)}')
+
+    def close(self) -> None:
+        """Flushes staged files and waits for the archive copies."""
+        try:
+            self.flush()
+        finally:
+            self._archive_executor.shutdown(wait=True)
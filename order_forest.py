@@ -0,0 +1,73 @@
+from typing import Optional
+
+
+class OrderForest:
+    """
+    Parent/child index over one batch of CRM orders.
+    Built once per sync cycle so tree lookups don't rescan the whole batch for every order.
+    """
+
+    def __init__(self, crm_orders: list[dict]):
+        self.orders_map: dict[int, dict] = {}
+        self.children_map: dict[Optional[int], list[int]] = {}
+        self._roots: dict[int, int] = {}
+        for order in crm_orders:
+            self.orders_map[order['id']] = order
+            self.children_map.setdefault(order['parent_id'], []).append(order['id'])
+
+    def add(self, order: dict) -> None:
+        """Adds an order fetched outside the batch, e.g. a descendant of a root order of the batch."""
+        self.orders_map[order['id']] = order
+        self.children_map.setdefault(order['parent_id'], []).append(order['id'])
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self.orders_map
+
+    def missing_parent_ids(self) -> set[int]:
+        """Returns ids of parents that are not in the batch."""
+        return {parent_id for parent_id in self.children_map if parent_id is not None and parent_id not in self}
+
+    def subtree(self, order_id: int) -> list[dict]:
+        """Returns the order and all its descendants of any level (depth-first, order itself first)."""
+        result = []
+        stack = [order_id]
+        while stack:
+            curr_order_id = stack.pop()
+            result.append(self.orders_map[curr_order_id])
+            if curr_order_id in self.children_map:
+                stack.extend(self.children_map[curr_order_id])
+        return result
+
+    def resolve_root(self, order_id: int) -> tuple[int, bool]:
+        """
+        Walks up the tree inside the batch.
+        :return: (root id, True) if the root was found,
+                 (id of the first ancestor missing from the batch, False) otherwise.
+        """
+        path = []
+        curr_order_id = order_id
+        while True:
+            if curr_order_id in self._roots:
+                root_id = self._roots[curr_order_id]
+                break
+            curr_order = self.orders_map.get(curr_order_id)
+            if curr_order is None:
+                return curr_order_id, False
+            path.append(curr_order_id)
+            if curr_order['parent_id'] is None:
+                root_id = curr_order_id
+                break
+            curr_order_id = curr_order['parent_id']
+
+        for node_id in path:
+            self._roots[node_id] = root_id
+        return root_id, True
+
+    def root_of(self, order_id: int) -> Optional[int]:
+        """Returns root id or None if the tree goes outside the batch."""
+        root_id, found = self.resolve_root(order_id)
+        return root_id if found else None
+
+    def set_root(self, order_id: int, root_id: int) -> None:
+        """Remembers the root of an order resolved outside the batch (e.g. via API)."""
+        self._roots[order_id] = root_id
@@ -1,25 +1,33 @@
+import json
 from openai import OpenAI
 import constants
 
 client = OpenAI(api_key=constants.OPENAI_UKRSALON_API_KEY)
 model = 'gpt-4o-mini'
 timeout = 5
+reorder_names_instruction = ('Тебе необходимо записать в правильной последовательности данные клиента. '
+                             'Последовательность такая:\nФамилия Имя Отчество\n'
+                             'В ответе надо указать ИСКЛЮЧИТЕЛЬНО Фамилию Имя Отчество клиента.\n'
+                             'Если какой-то из элеметов ФИО отсутсвует, то его не надо указывать.\n'
+                             'Если в переданных данных присутсвует какое-то посторонее слово, '
+                             'кроме фамилии, имени, отчества, тогда твой ответ - это пустая строка. '
+                             'НЕ НУЖНО ПЕРЕДАВАТЬ ЧАСТЬ СЛОВ ИЛИ СИМВОЛОВ! Ты либо передаёшь ВСЕ слова '
+                             'в правильной последовательности, либо пустую строку!\n'
+                             'НЕ НУЖНО ВКЛЮЧАТЬ В ОТВЕТ ОБЪЯСНЕНИЯ!\n'
+                             )
+reorder_names_batch_instruction = ('Тебе передан JSON массив, каждый элемент - данные отдельного клиента. '
+                                   'Ответ - JSON массив строк той же длины и в том же порядке, '
+                                   'каждый элемент - ответ для соответствующего клиента. '
+                                   'Ответ должен содержать ТОЛЬКО JSON массив.\n'
+                                   )
+
 
 def ai_reorder_names(fio: str) -> str:
     completion = client.chat.completions.create(
         model= model,
         messages=[
             {'role': 'system', 'content': 'Ты дотошный нотариус'},
-            {'role': 'user', 'content': 'Тебе необходимо записать в правильной последовательности данные клиента. '
-                                        'Последовательность такая:\nФамилия Имя Отчество\n'
-                                        'В ответе надо указать ИСКЛЮЧИТЕЛЬНО Фамилию Имя Отчество клиента.\n'
-                                        'Если какой-то из элеметов ФИО отсутсвует, то его не надо указывать.\n'
-                                        'Если в переданных данных присутсвует какое-то посторонее слово, '
-                                        'кроме фамилии, имени, отчества, тогда твой ответ - это пустая строка. '
-                                        'НЕ НУЖНО ПЕРЕДАВАТЬ ЧАСТЬ СЛОВ ИЛИ СИМВОЛОВ! Ты либо передаёшь ВСЕ слова '
-                                        'в правильной последовательности, либо пустую строку!\n'
-                                        'НЕ НУЖНО ВКЛЮЧАТЬ В ОТВЕТ ОБЪЯСНЕНИЯ!\n'
-                                        },
+            {'role': 'user', 'content': reorder_names_instruction},
             {'role': 'user', 'content': fio},
 
         ],
@@ -28,3 +36,22 @@ def ai_reorder_names(fio: str) -> str:
 
     answer = completion.choices[0].message.content
     return answer
+
+
+def ai_reorder_names_batch(fios: list[str]) -> list[str]:
+    """Reorders several names with one request, answers are in the order of fios."""
+    completion = client.chat.completions.create(
+        model=model,
+        messages=[
+            {'role': 'system', 'content': 'Ты дотошный нотариус'},
+            {'role': 'user', 'content': reorder_names_instruction + reorder_names_batch_instruction},
+            {'role': 'user', 'content': json.dumps(fios, ensure_ascii=False)},
+        ],
+        timeout=timeout
+    )
+
+    answer = completion.choices[0].message.content.strip().removeprefix('```json').strip('`').strip()
+    answers = json.loads(answer)
+    if not isinstance(answers, list) or len(answers) != len(fios):
+        raise ValueError(f'AI answered {answer} for {len(fios)} names')
+    return [str(answer or '') for answer in answers]
@@ -0,0 +1,131 @@
+"""
+Local reordering of buyer names into 'Прізвище Ім'я По батькові' without AI.
+Roles of the words are guessed from patronymic and surname suffixes and dictionaries of given names and surnames.
+Only confident answers are used, the rest of the names go to AI. An answer is never confident unless the word
+taken for the surname looks like one by itself (typical suffix or a known surname): 'Олена Магазин' goes to AI.
+"""
+import re
+from itertools import permutations
+from typing import Optional
+
+MIN_CONFIDENCE = 0.95
+
+MALE_NAMES = frozenset('''
+    олександр александр андрій андрей артем артём богдан борис вадим валентин валерій валерий василь василий
+    віктор виктор віталій виталий владислав володимир владимир вячеслав в'ячеслав геннадій геннадий георгій
+    георгий григорій григорий данило даниил денис дмитро дмитрий євген евгений єгор егор захар іван иван ігор
+    игорь ілля илья кирило кирилл костянтин константин леонід леонид максим микита никита микола николай
+    михайло михаил назар олег олексій алексей павло павел петро петр пётр роман руслан сергій сергей станіслав
+    станислав степан тарас тимур тимофій тимофей федір федор юрій юрий ярослав анатолій анатолий аркадій
+    аркадий антон арсен арсеній арсений вікентій веніамін вениамин всеволод гліб глеб давид едуард эдуард
+    еміль эмиль зіновій ілько йосип иосиф лев марко мирослав орест остап семен семён святослав філіп филипп
+    яків яков ростислав радислав марк мартин матвій матвей нестор олесь платон прохор савелій савелий
+'''.split())
+
+FEMALE_NAMES = frozenset('''
+    олександра александра алла алина аліна анастасія анастасия ангеліна ангелина анна ганна антоніна антонина
+    валентина валерія валерия вероніка вероника віра вера вікторія виктория галина дарина дарья дар'я діана
+    диана євгенія евгения єлизавета елизавета катерина екатерина ксенія ксения лариса людмила любов любовь
+    марина марія мария мирослава надія надежда наталія наталья наталия ніна нина оксана олена елена ольга
+    поліна полина раїса раиса світлана светлана софія софия тамара тетяна татьяна уляна ульяна юлія юлия
+    яна ярослава інна инна ірина ирина зоя зінаїда зинаида лідія лидия леся лілія лилия майя мілана милана
+    нонна олеся регіна регина сніжана снежана таїсія таисия христина кристина емілія эмилия зоряна богдана
+    владислава віталіна виталина вікторина жанна злата іванна каріна карина кіра кира лана лєна маргарита
+    настя соломія станіслава тереза фаїна фаина аліса алиса василина єва ева мар'яна марьяна наталя
+'''.split())
+
+SURNAMES = frozenset('''
+    коваль мельник бондар гончар кравець ткач швець мороз вовк лях сокіл дуб кушнір литвин пономар бабич кучер
+    дорош ярош мазур рибак козак бурлака чорний сірий білий стець сич гриб лебідь кіт щур бойко головко савка
+    кулик гордій гуменний кузьмич палій пасічник приходько цибуля шульга
+'''.split())
+
+MALE_PATRONYMIC_SUFFIXES = ('ович', 'евич', 'євич', 'йович', 'ілліч', 'ильич', 'ьмич', 'кич')
+FEMALE_PATRONYMIC_SUFFIXES = ('івна', 'ївна', 'овна', 'евна', 'ічна', 'ична', 'инична')
+SURNAME_SUFFIXES = ('енко', 'чук', 'щук', 'юк', 'ук', 'ський', 'цький', 'ська', 'цька', 'ский', 'цкий', 'ская',
+                    'цкая', 'ов', 'ова', 'ев', 'ева', 'єв', 'єва', 'як', 'ик', 'ець', 'ишин')
+WEAK_SURNAME_SUFFIXES = ('ін', 'іна', 'ин', 'ина', 'ко', 'ак', 'ич', 'ар', 'ий', 'ій', 'ло', 'ів')  # Магазин, Львів
+
+_word = re.compile(r"^[а-яёіїєґ]+(?:['’ʼ-][а-яёіїєґ]+)*$")
+
+
+def _normalize_word(word: str) -> str:
+    return word.lower().replace('’', "'").replace('ʼ', "'")
+
+
+def _gender(word: str) -> Optional[str]:
+    word = _normalize_word(word)
+    if word in MALE_NAMES or word.endswith(MALE_PATRONYMIC_SUFFIXES):
+        return 'm'
+    if word in FEMALE_NAMES or word.endswith(FEMALE_PATRONYMIC_SUFFIXES):
+        return 'f'
+    return None
+
+
+def _is_surname_like(word: str) -> bool:
+    """Positive surname signal: a known surname or a typical surname suffix of a word that is not a name."""
+    word = _normalize_word(word)
+    if word in SURNAMES:
+        return True
+    is_name = word in MALE_NAMES or word in FEMALE_NAMES
+    return not is_name and word.endswith(SURNAME_SUFFIXES)
+
+
+def _role_likelihoods(word: str) -> dict[str, float]:
+    word = _normalize_word(word)
+    is_patronymic = word.endswith(MALE_PATRONYMIC_SUFFIXES + FEMALE_PATRONYMIC_SUFFIXES)
+    is_name = word in MALE_NAMES or word in FEMALE_NAMES
+    if is_name:
+        surname = 0.05
+    elif is_patronymic:
+        surname = 0.05  # Мицкевич, Петрович are surnames too
+    elif word in SURNAMES or word.endswith(SURNAME_SUFFIXES):
+        surname = 0.9
+    elif word.endswith(WEAK_SURNAME_SUFFIXES):
+        surname = 0.7
+    else:
+        surname = 0.5
+    return {
+        'surname': surname,
+        'name': 0.95 if is_name else 0.01,
+        'patronymic': 0.98 if is_patronymic and len(word) > 4 else 0.005,
+    }
+
+
+def _capitalize(word: str) -> str:
+    return '-'.join(part[:1].upper() + part[1:].lower() for part in word.split('-'))
+
+
+def score_fio(fio: str) -> tuple[Optional[str], float]:
+    """
+    Finds the most likely order of the words.
+    :return: reordered and capitalized name and confidence 0..1; (None, 0.0) if the name can't be handled locally
+    """
+    words = fio.split()
+    if len(words) not in (2, 3) or not all(_word.match(_normalize_word(word)) for word in words):
+        return None, 0.0
+    roles = ('surname', 'name', 'patronymic')[:len(words)]
+    likelihoods = [_role_likelihoods(word) for word in words]
+    genders = [_gender(word) for word in words]
+    if len(words) == 2 and any(likelihood['patronymic'] > 0.5 for likelihood in likelihoods):
+        return None, 0.0  # Олена Петрівна - no surname, AI knows better
+
+    scores = {}
+    for order in permutations(range(len(words))):  # order[i] - index of the word playing roles[i]
+        score = 1.0
+        for role, index in zip(roles, order):
+            score *= likelihoods[index][role]
+        scores[order] = score
+    best = max(scores, key=scores.get)
+    new_fio = ' '.join(_capitalize(words[index]) for index in best)
+    if len(words) == 3 and None not in (genders[best[1]], genders[best[2]]) and genders[best[1]] != genders[best[2]]:
+        return new_fio, 0.0  # Олена Петрович - a typo or not a name at all
+    if not _is_surname_like(words[best[0]]):
+        return new_fio, 0.0  # Олена Магазин, Іван Пошта - the surname is only what is left over
+    return new_fio, scores[best] / sum(scores.values())
+
+
+def reorder_names_locally(fio: str, min_confidence: float = MIN_CONFIDENCE) -> Optional[str]:
+    """Returns the reordered name if the rules are confident enough, None if AI is needed."""
+    new_fio, confidence = score_fio(fio)
+    return new_fio if confidence >= min_confidence else None
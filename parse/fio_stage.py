@@ -0,0 +1,106 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional
+from loguru import logger
+from db.fio_cache import FioCache
+from parse.ai import ai_reorder_names, ai_reorder_names_batch
+from parse.fio_rules import reorder_names_locally
+
+
+class FioStage:
+    """
+    Reorders buyer names of one sync cycle with AI before their JSON files are written.
+    Names the local rules are sure about don't leave the process, cached names are taken from FioCache,
+    the rest go to AI in parallel, several names per prompt.
+    Names AI did not answer for until the cycle deadline stay raw; late answers still land in the cache.
+    """
+
+    def __init__(self, fio_cache: FioCache, max_in_flight: int, names_per_request: int, deadline: float):
+        """
+        :param fio_cache: cache of AI results
+        :param max_in_flight: AI requests sent at the same time
+        :param names_per_request: names sent to AI in one prompt
+        :param deadline: sec from the cycle start to wait for AI answers
+        """
+        self.fio_cache = fio_cache
+        self.names_per_request = names_per_request
+        self.deadline = deadline
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='fio')
+        self._pending: set[str] = set()
+        self._results: dict[str, Optional[str]] = {}
+        self._deadline_at = time.monotonic() + deadline
+        self.timed_out = 0
+        self.reordered_locally = 0
+
+    def start_cycle(self) -> None:
+        self._pending.clear()
+        self._results.clear()
+        self._deadline_at = time.monotonic() + self.deadline
+
+    def add(self, fio: str) -> None:
+        if fio in self._results:
+            return
+        new_fio = reorder_names_locally(fio)
+        if new_fio is None:
+            self._pending.add(fio)
+        else:
+            self._results[fio] = new_fio
+            self.reordered_locally += 1
+
+    def is_resolved(self, fio: str) -> bool:
+        return fio in self._results
+
+    def get(self, fio: str) -> Optional[str]:
+        """Returns AI result ('' for not recognized names) or None if AI did not answer in time."""
+        return self._results.get(fio)
+
+    def resolve(self) -> None:
+        """Resolves all added names, returns at the latest at the cycle deadline. Repeated calls are cheap."""
+        to_ask = []
+        for fio in self._pending:
+            try:
+                cached = self.fio_cache.get(fio)
+            except Exception as e:
+                logger.error(f'FIO cache failed for {fio}, left as is | {str(e)}')
+                self._results[fio] = None
+                continue
+            if cached is None:
+                to_ask.append(fio)
+            else:
+                self._results[fio] = cached
+        self._pending.clear()
+        if not to_ask:
+            return
+
+        futures = {self._executor.submit(self._ask, to_ask[i:i + self.names_per_request]):
+                   to_ask[i:i + self.names_per_request] for i in range(0, len(to_ask), self.names_per_request)}
+        done, not_done = wait(futures, timeout=max(0.0, self._deadline_at - time.monotonic()))
+        for future in done:
+            self._results.update(future.result())
+        for future in not_done:
+            self._results.update(dict.fromkeys(futures[future]))
+            self.timed_out += len(futures[future])
+        if not_done:
+            logger.warning(f'AI did not reorder {sum(len(futures[future]) for future in not_done)} names '
+                           f'in {self.deadline} sec, they are left as is')
+
+    def _ask(self, fios: list[str]) -> dict[str, Optional[str]]:
+        """Runs in the pool, never raises. Successful answers are cached."""
+        try:
+            answers = ai_reorder_names_batch(fios) if len(fios) > 1 else [ai_reorder_names(fios[0]) or '']
+        except Exception as e:
+            logger.warning(f'AI failed to reorder {len(fios)} names at once, asking one by one | {str(e)}')
+            answers = []
+            for fio in fios:
+                try:
+                    answers.append(ai_reorder_names(fio) or '')
+                except Exception as e:
+                    logger.error(f'AI failed to reorder names in {fio} | {str(e)}')
+                    answers.append(None)
+        for fio, answer in zip(fios, answers):
+            if answer is not None:
+                self.fio_cache.put(fio, answer)
+        return dict(zip(fios, answers))
+
+    def __repr__(self):
+        return f'FIO stage reordered locally: {self.reordered_locally} AI timed out: {self.timed_out}'
@@ -1,8 +1,12 @@
+import tempfile
 from enum import Enum, StrEnum
+from pathlib import Path
 
 ukrsalon_crm_id = 10  # Ідентифікатор джерела Укрсалон
 insta_ukrsalon_crm_id = 5  # Ідентифікатор джерела Инстаграм Укрсалон
 sku_to_name_xml_file = 'c:/Quad Solutions/files/1_ main/ukrstil_ua.xml'
+sku_feed_check_interval = 60  # sec, how often the feed file is checked for changes
+sku_catalog_dir = Path(tempfile.gettempdir())  # SQLite SKU stores shared by all sync processes of the host
 TTN_SENT_BY_CAR = '00000000000000'
 FAKE_SUPPLIER = 'Фиктивный поставщик'
 
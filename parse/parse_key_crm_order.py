@@ -1,3 +1,4 @@
+from types import MappingProxyType
 from typing import Optional
 from common_funcs import international_phone
 from parse.parse_constants import (
@@ -15,7 +16,7 @@ from parse.parse_constants import (
     TTN_SENT_BY_CAR
 )
 from parse.process_xml import get_name_and_category_by_sku
-from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator, model_validator
 from tools.round import classic_round
 
 
@@ -107,6 +108,96 @@ class Shipping(BaseModel):
     recipient_phone: Optional[str] = None
 
 
+NORMALIZED = 'normalized'  # validation context flag: the data is already normalize_crm_order output
+
+
+def normalize_crm_order(model: dict) -> dict:
+    """
+    Converts a CRM order dict to the fields of the 1C orders.
+    The CRM dict is not modified: buyer, shipping and products are copied before they are changed.
+    """
+    model = dict(model)
+    model['buyer'] = model['buyer'] and dict(model['buyer'])
+    model['shipping'] = dict(model['shipping'])
+    model['products'] = [dict(product) for product in model['products']]
+    model['id'] = str(model['id'])
+    if model['parent_id']:
+        model['parent_id'] = str(model['parent_id'])
+
+    model['shop'] = shop_key_to_1c.get(model['source_id'])
+    model['shop_sql_id'] = shop_crm_id_to_sql_shop_id.get(model['source_id'], 1)
+
+    if model['buyer']:
+        model['buyer']['phone'] = international_phone(model['buyer']['phone'])
+        model['shipping']['recipient_phone'] = international_phone(model['shipping']['recipient_phone'])
+        if model['shipping']['recipient_phone'] == model['buyer']['phone']:
+            model['shipping']['recipient_full_name'] = None
+            model['shipping']['recipient_phone'] = None
+        model['buyer']['has_duplicates'] = model['buyer']['has_duplicates'] > 0
+
+    model['manager'] = model['manager'] and manager_key_to_1c.get(model['manager']['id'])
+
+    if model['total_discount']:
+        prices = [product['price_sold'] for product in model['products']]
+        index = prices.index(max(prices))
+        one_product_price = (model['products'][index]['price_sold'] -
+                             model['total_discount'] / float(model['products'][index]['quantity']))
+        model['products'][index]['price_sold'] = classic_round(one_product_price, 2)
+
+    for product in model['products']:
+        if product['sku']:
+            new_name, category = get_name_and_category_by_sku(product['sku'])
+            if new_name:
+                product['name'] = new_name
+            elif product['name'][:3].isupper():
+                product['name'] = product['name'].capitalize()
+            product['category'] = category
+
+    model['tracking_code'] = model['shipping']['tracking_code']
+
+    for custom_field in model['custom_fields']:
+        match custom_field['name']:
+            case 'Постачальник':
+                model['supplier'] = custom_field['value'][0]
+            case 'Номер постачальника':
+                model['supplier_id'] = custom_field['value']
+            case 'Заказ 1С':
+                model['push_to_1C'] = custom_field['value']
+            case 'Відправлено машиною':
+                if custom_field['value']:
+                    model['tracking_code'] = TTN_SENT_BY_CAR
+
+    paid_by_card = False
+    payment_name_paid_by_card, payment_name_paid, payment_name_not_paid = None, None, None
+    for payment in model.get('payments', []):
+        p_name = payment_crm_id_to_1c.get(payment['payment_method_id'])
+        if payment['status'] == PaymentStatus.PAID:
+            if p_name in paid_by_card_methods:
+                paid_by_card = True
+                payment_name_paid_by_card = p_name
+            else:
+                payment_name_paid = p_name
+        else:
+            payment_name_not_paid = p_name
+     
+    if (model['shop'] in [Shops.UKRSTIL.value, Shops.BEAUTY_MARKET.value, Shops.KRASUNIA.value] and
+        payment_name_not_paid in paid_by_card_methods):
+            payment_name_not_paid = None
+    model['payment'] = (payment_name_paid_by_card or payment_name_paid or payment_name_not_paid)
+
+    if not paid_by_card:
+        for product in model['products']:
+            quantity = float(product['quantity'])
+            if (product['price_sold'] * quantity) % 1 != 0:
+                if quantity % 2 != 0:
+                    product['price_sold'] = classic_round(product['price_sold'])
+                else:
+                    product['price_sold'] = classic_round(product['price_sold'] * quantity) / quantity
+                model['prices_rounded'] = True
+
+    return model
+
+
 class Order1CBuyer(BaseModel):
     action: str = Field(default='create_buyer_order')
     document_type: Document1C = Field(default=Document1C.CLIENT_ORDER, exclude=True)
@@ -133,83 +224,10 @@ class Order1CBuyer(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
     @model_validator(mode='before')
-    def get_nested(cls, model):
-        model['id'] = str(model['id'])
-        if model['parent_id']:
-            model['parent_id'] = str(model['parent_id'])
-
-        model['shop'] = shop_key_to_1c.get(model['source_id'])
-        model['shop_sql_id'] = shop_crm_id_to_sql_shop_id.get(model['source_id'], 1)
-
-        if model['buyer']:
-            model['buyer']['phone'] = international_phone(model['buyer']['phone'])
-            model['shipping']['recipient_phone'] = international_phone(model['shipping']['recipient_phone'])
-            if model['shipping']['recipient_phone'] == model['buyer']['phone']:
-                model['shipping']['recipient_full_name'] = None
-                model['shipping']['recipient_phone'] = None
-            model['buyer']['has_duplicates'] = model['buyer']['has_duplicates'] > 0
-
-        model['manager'] = model['manager'] and manager_key_to_1c.get(model['manager']['id'])
-
-        if model['total_discount']:
-            prices = [product['price_sold'] for product in model['products']]
-            index = prices.index(max(prices))
-            one_product_price = (model['products'][index]['price_sold'] -
-                                 model['total_discount'] / float(model['products'][index]['quantity']))
-            model['products'][index]['price_sold'] = classic_round(one_product_price, 2)
-
-        for product in model['products']:
-            if product['sku']:
-                new_name, category = get_name_and_category_by_sku(product['sku'])
-                if new_name:
-                    product['name'] = new_name
-                elif product['name'][:3].isupper():
-                    product['name'] = product['name'].capitalize()
-                product['category'] = category
-
-        model['tracking_code'] = model['shipping']['tracking_code']
-
-        for custom_field in model['custom_fields']:
-            match custom_field['name']:
-                case 'Постачальник':
-                    model['supplier'] = custom_field['value'][0]
-                case 'Номер постачальника':
-                    model['supplier_id'] = custom_field['value']
-                case 'Заказ 1С':
-                    model['push_to_1C'] = custom_field['value']
-                case 'Відправлено машиною':
-                    if custom_field['value']:
-                        model['tracking_code'] = TTN_SENT_BY_CAR
-
-        paid_by_card = False
-        payment_name_paid_by_card, payment_name_paid, payment_name_not_paid = None, None, None
-        for payment in model.get('payments', []):
-            p_name = payment_crm_id_to_1c.get(payment['payment_method_id'])
-            if payment['status'] == PaymentStatus.PAID:
-                if p_name in paid_by_card_methods:
-                    paid_by_card = True
-                    payment_name_paid_by_card = p_name
-                else:
-                    payment_name_paid = p_name
-            else:
-                payment_name_not_paid = p_name
-         
-        if (model['shop'] in [Shops.UKRSTIL.value, Shops.BEAUTY_MARKET.value, Shops.KRASUNIA.value] and
-            payment_name_not_paid in paid_by_card_methods):
-                payment_name_not_paid = None
-        model['payment'] = (payment_name_paid_by_card or payment_name_paid or payment_name_not_paid)
-
-        if not paid_by_card:
-            for product in model['products']:
-                quantity = float(product['quantity'])
-                if (product['price_sold'] * quantity) % 1 != 0:
-                    if quantity % 2 != 0:
-                        product['price_sold'] = classic_round(product['price_sold'])
-                    else:
-                        product['price_sold'] = classic_round(product['price_sold'] * quantity) / quantity
-                    model['prices_rounded'] = True
-
-        return model
+    def get_nested(cls, model, info: ValidationInfo):
+        if info.context and info.context.get(NORMALIZED):
+            return model
+        return normalize_crm_order(model)
 
 
 class Order1CSupplier(Order1CBuyer):
@@ -233,6 +251,36 @@ class Order1CSupplierUpdate(Order1CSupplier):
     action: str = Field(default='update_supplier_order')
 
 
+class CrmOrder:
+    """
+    CRM order normalized once by normalize_crm_order, read-only.
+    The 1C orders are derived from the normalized fields by to_buyer(), to_supplier() and to_supplier_update()
+    without another normalization (no phone formatting or SKU lookups); every call returns a new 1C order.
+    Invalid orders raise on creation, like Order1CBuyer(**order_dict) does.
+    """
+    __slots__ = ('_fields', '_buyer')
+
+    def __init__(self, order_dict: dict):
+        self._fields = MappingProxyType(normalize_crm_order(order_dict))
+        self._buyer: Optional[Order1CBuyer] = self._validate(Order1CBuyer)
+
+    def _validate(self, order_class: type[Order1CBuyer]) -> Order1CBuyer:
+        return order_class.model_validate(self._fields, context={NORMALIZED: True})
+
+    def to_buyer(self) -> Order1CBuyer:
+        order, self._buyer = self._buyer, None  # the order validated on creation is handed out once
+        return order or self._validate(Order1CBuyer)
+
+    def to_supplier(self) -> Order1CSupplier:
+        return self._validate(Order1CSupplier)
+
+    def to_supplier_update(self) -> Order1CSupplierUpdate:
+        return self._validate(Order1CSupplierUpdate)
+
+    def buyer_products(self) -> list[ProductBuyer]:
+        return [ProductBuyer.model_validate(product) for product in self._fields['products']]
+
+
 class Order1CSupplierPromCommissionOrder(BaseModel):
     action: str = Field(default='create_supplier_order')
     document_type: Document1C = Field(default=Document1C.SUPPLIER_ORDER, exclude=True)
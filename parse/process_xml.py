@@ -1,53 +1,182 @@
 import xml.etree.cElementTree as ET
-import datetime
+import os
+import sqlite3
+import threading
+import time
 from pathlib import Path
 from typing import Optional
+from loguru import logger
 
-from parse.parse_constants import sku_to_name_xml_file
+from parse.parse_constants import sku_to_name_xml_file, sku_feed_check_interval, sku_catalog_dir
 
-root = None
+STORE_PREFIX = 'sku_catalog_'
+STORE_SUFFIX = '.sqlite3'
+SUPERSEDED_STORE_TTL = 3600  # sec, other processes switch to a new store within sku_feed_check_interval + its build
 
+store_file: Optional[Path] = None  # SKU store of the feed version in use, shared by all processes of the host
+catalog_feed_state: Optional[tuple[int, int]] = None  # (mtime_ns, size) of the feed the store was built from
+failed_feed_state: Optional[tuple[int, int]] = None  # the feed that could not be parsed, not retried until it changes
+feed_checked_at = 0.0
+catalog_lock = threading.Lock()
+reload_thread: Optional[threading.Thread] = None
+connections = threading.local()  # read-only connection of every thread to store_file
 
-def is_time(hour: Optional[int] = None, minute: Optional[int] = None) -> bool:
+
+def load_catalog(xml_file: Path | str) -> dict[str, tuple[Optional[str], Optional[int]]]:
+    """
+    Builds the SKU index of the feed: lowercased vendorCode -> (name, categoryId).
+    The feed is read with iterparse, every offer is dropped after its fields are taken.
+    The first offer of a duplicated SKU wins.
     """
-    Checks if the current time is within a 10-minute window after the specified hour and minute.
+    index = {}
+    for _, element in ET.iterparse(xml_file, events=('end',)):
+        if element.tag != 'offer':
+            continue
+        sku = element.findtext('vendorCode')
+        name_tag = element.find('name')
+        if sku is not None and name_tag is not None:
+            category = element.findtext('categoryId')
+            index.setdefault(sku.lower(), (name_tag.text, int(category) if category else None))
+        element.clear()
+    return index
+
+
+def get_feed_state(xml_file: Path | str) -> Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(xml_file)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
 
-    :param hour: The hour to check against (defaults to the current hour).
-    :param minute: The minute to check against (defaults to 0).
-    :return: True if the current time falls within the 10-minute window, False otherwise.
-    :rtype: bool
+def get_store_file(feed_state: tuple[int, int]) -> Path:
+    mtime_ns, size = feed_state
+    return sku_catalog_dir / f'{STORE_PREFIX}{mtime_ns}_{size}{STORE_SUFFIX}'
+
+
+def build_store(xml_file: Path | str, feed_state: tuple[int, int]) -> Path:
     """
+    Writes the SKU index of the feed version to its SQLite store, unless another process already did.
+    The store is written under a temporary name and renamed, readers never open a half-built store.
+    Stores of older feed versions are kept for SUPERSEDED_STORE_TTL after a newer one appeared,
+    so processes that have not checked the feed yet still can open them.
+    """
+    path = get_store_file(feed_state)
+    if not path.exists():
+        temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        temp_path.unlink(missing_ok=True)
+        conn = sqlite3.connect(temp_path)
+        try:
+            conn.execute('CREATE TABLE catalog (sku TEXT PRIMARY KEY, name TEXT, category INTEGER) WITHOUT ROWID')
+            conn.executemany('INSERT INTO catalog VALUES (?, ?, ?)',
+                             ((sku, name, category) for sku, (name, category) in load_catalog(xml_file).items()))
+            conn.commit()
+        finally:
+            conn.close()
+        try:
+            os.replace(temp_path, path)
+        except OSError:  # another process has just put the same store in place and opened it
+            temp_path.unlink(missing_ok=True)
+        logger.info(f'SKU store {path.name} built')
+    remove_superseded_stores(keep=path)
+    return path
+
 
-    if minute is None:
-        minute = 0
-    if hour is None:
-        hour = datetime.datetime.now().hour
-    close_time = datetime.datetime.combine(datetime.datetime.today(), datetime.time(hour=hour, minute=minute))
-    if close_time < datetime.datetime.now() < close_time + datetime.timedelta(minutes=2):
-        return True
+def remove_superseded_stores(keep: Path) -> None:
+    """Removes stores replaced by a newer one more than SUPERSEDED_STORE_TTL ago."""
+    stores = []
+    for store in sku_catalog_dir.glob(f'{STORE_PREFIX}*{STORE_SUFFIX}'):
+        try:
+            stores.append((store.stat().st_mtime, store))
+        except OSError:  # removed by another process
+            pass
+    stores.sort()
+    now = time.time()
+    for (_, store), (superseded_at, _) in zip(stores, stores[1:]):
+        if store != keep and now - superseded_at > SUPERSEDED_STORE_TTL:
+            try:
+                store.unlink()
+            except OSError:  # still open by a process on Windows, removed by a later build
+                pass
+
+
+def reload_store(xml_file: Path | str, feed_state: tuple[int, int]) -> None:
+    """Builds (or finds) the store of the new feed version and switches lookups to it with one assignment."""
+    global store_file, catalog_feed_state, failed_feed_state
+    try:
+        new_store_file = build_store(xml_file, feed_state)
+    except Exception as e:  # e.g. the feed is being rewritten, retried when it changes again
+        failed_feed_state = feed_state
+        logger.error(f'Failed to reload SKU feed {xml_file} | {str(e)}')
+        return
+    store_file, catalog_feed_state = new_store_file, feed_state
+
+
+def check_feed(xml_file: Path | str) -> None:
+    """Starts a background reload if the feed file changed; the file is checked at most every sku_feed_check_interval."""
+    global feed_checked_at, reload_thread
+    now = time.monotonic()
+    if now - feed_checked_at < sku_feed_check_interval:
+        return
+    with catalog_lock:
+        if now - feed_checked_at < sku_feed_check_interval:
+            return
+        feed_checked_at = now
+        feed_state = get_feed_state(xml_file)
+        if feed_state is None or feed_state in (catalog_feed_state, failed_feed_state):
+            return
+        if reload_thread is not None and reload_thread.is_alive():
+            return
+        reload_thread = threading.Thread(target=reload_store, args=(xml_file, feed_state), name='sku_feed_reload',
+                                         daemon=True)
+        reload_thread.start()
+
+
+def open_store(xml_file: Path | str) -> None:
+    """
+    First use in the process: opens the store of the current feed version, building it only if no process did yet.
+    Without the feed file the newest existing store is used.
+    """
+    global store_file, catalog_feed_state, feed_checked_at
+    feed_state = get_feed_state(xml_file)
+    if feed_state is None:
+        stores = sorted(sku_catalog_dir.glob(f'{STORE_PREFIX}*{STORE_SUFFIX}'), key=lambda path: path.stat().st_mtime)
+        if not stores:
+            raise FileNotFoundError(f'SKU feed {xml_file} not found and there is no SKU store')
+        store_file = stores[-1]
     else:
-        return False
+        store_file, catalog_feed_state = build_store(xml_file, feed_state), feed_state
+    feed_checked_at = time.monotonic()
 
 
-def get_xml_root(xml_file: Path | str):
-    tree = ET.parse(xml_file)
-    return tree.getroot()
+def get_connection() -> sqlite3.Connection:
+    if store_file is None:
+        with catalog_lock:
+            if store_file is None:
+                open_store(Path(sku_to_name_xml_file))
+    else:
+        check_feed(Path(sku_to_name_xml_file))
+    path = store_file
+    if getattr(connections, 'path', None) != path:
+        if getattr(connections, 'conn', None) is not None:
+            connections.conn.close()
+        try:
+            conn = sqlite3.connect(f'{path.as_uri()}?mode=ro', uri=True)
+        except sqlite3.OperationalError:  # the store was removed, e.g. it is long superseded and the feed is gone
+            with catalog_lock:
+                if store_file == path:
+                    open_store(Path(sku_to_name_xml_file))
+            path = store_file
+            conn = sqlite3.connect(f'{path.as_uri()}?mode=ro', uri=True)
+        connections.conn, connections.path = conn, path
+    return connections.conn
 
 
 def get_name_and_category_by_sku(sku: str) -> tuple[Optional[str], Optional[int]]:
-    global root
-    if root is None or is_time(minute=0):
-        root = get_xml_root(Path(sku_to_name_xml_file))
-
-    for offer in root.findall(".//offer"):
-        sku_tag = offer.find('vendorCode')
-        name_tag = offer.find('name')
-        if sku_tag is not None and name_tag is not None:
-            if sku_tag.text.lower() == sku.lower():
-                name = name_tag.text
-                category_tag = offer.find('categoryId')
-                category = int(category_tag.text) if category_tag is not None and category_tag.text else None
-                return name, category
-    return None, None
+    row = get_connection().execute('SELECT name, category FROM catalog WHERE sku = ?', (sku.lower(),)).fetchone()
+    return (row[0], row[1]) if row else (None, None)
 
 
+if __name__ == '__main__':  # build the store ahead of the sync processes: python -m parse.process_xml
+    open_store(Path(sku_to_name_xml_file))
+    print(f'SKU store: {store_file}')
@@ -1,4 +1,4 @@
-import requests
+from api.transport import get_transport
 from loguru import logger
 import os
 from dotenv import load_dotenv
@@ -12,6 +12,8 @@ sms_login = os.getenv('sms_login')
 sms_password = os.getenv('sms_password')
 sms_url = "https://gate.smsclub.mobi/xml/"
 sms_headers = {'Content-Type': 'text/xml; charset=utf-8'}
+sms_request_timeout = 20
+sms_transport = get_transport(sms_url, timeout=sms_request_timeout)
 alpha_names = [
     os.getenv('alpha_shop_zakaz'),
     os.getenv('alpha_ukrsalon'),
@@ -67,7 +69,7 @@ def send_sms(phone: str, alpha_name: str, text: str):
                 </request_sendsms>"""
     # print('sending: ', alpha_name, phone, text)
     if DO_SEND_SMS:
-        r = requests.post(url=sms_url, data=xml.encode('utf-8'), headers=sms_headers)
+        r = sms_transport.post(url=sms_url, data=xml.encode('utf-8'), headers=sms_headers)
         log_text = f'SEND SMS: {phone} | {alpha_name} => | {text} | Reply: {r.text}'
         logger.info(log_text) if r else logger.error(log_text)
         return r
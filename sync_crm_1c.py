@@ -1,18 +1,35 @@
 import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from pathlib import Path
 from typing import Optional, Literal
 import constants
 from contextlib import redirect_stdout
-from api.key_crm_api import KeyCRM
+from api.key_crm_api import KeyCRM, Priority
+from common_funcs import international_phone
 from constants import IS_PRODUCTION_SERVER
+from db.archive_index import ArchiveIndex
 from db.db_init import Session_Sync, Session
-from db.models import Order1CDB, PromCPARefundOutbox, PromOrderDB, PromDeliveryCommissionOutbox
+from db.fingerprint_store import FingerprintStore, order_fingerprint
+from db.fio_cache import FioCache
+from db.orders_batch import OrdersBatch
+from db.source_uuid_index import SourceUuidIndex
+from db.models import (Json1COutbox, Order1CDB, OrderAncestryDB, PromCPARefundOutbox, PromOrderDB,
+                       PromDeliveryCommissionOutbox, SyncWatermarkDB)
 from db.sql_init import add_ttn_to_db
 from loguru import logger
 from messengers import send_service_tg_message
+from json_archive import JsonArchive
+from json_writer import JsonWriter
+from order_forest import OrderForest
 from parse.ai import ai_reorder_names
+from parse.fio_rules import reorder_names_locally
+from parse.fio_stage import FioStage
 from parse.parse_key_crm_order import (
+    CrmOrder,
     Order1CBuyer,
     Order1CPostupleniye,
     Order1CReturnTovarov,
@@ -27,17 +44,35 @@ from parse.parse_key_crm_order import (
     FakeProductSupplier
 )
 from tools.rich_log import RichLog
-from parse.parse_constants import TTN_SENT_BY_CAR, FAKE_SUPPLIER, PromStatus
+from parse.parse_constants import TTN_SENT_BY_CAR, FAKE_SUPPLIER, Document1C, PromStatus, manager_key_to_1c
 from retry import retry
 from send_sms import send_ttn_sms
 
 crm = KeyCRM(constants.CRM_API_KEY)
+crm_bulk = KeyCRM(constants.CRM_API_KEY, priority=Priority.LOW)  # full sweeps, yields to the other traffic
 rich_log = RichLog(header=f'Синхронизация CRM с 1С       {__file__}', header_style='bold white on cyan')
 
+CRM_WATERMARK_NAME = 'crm_1c_orders'
 parse_errors_orders_ids = []
+parsed_orders: dict[int, CrmOrder] = {}  # orders of the current cycle, normalized once
+prefiltered = Counter()  # orders of the current cycle rejected before parsing, by rule
+fingerprints = FingerprintStore()
+source_uuid_index = SourceUuidIndex()
+fio_cache = FioCache(Session_Sync)
+fio_stage = FioStage(fio_cache, max_in_flight=constants.FIO_AI_REQUESTS_IN_FLIGHT,
+                     names_per_request=constants.FIO_AI_NAMES_PER_REQUEST, deadline=constants.FIO_AI_CYCLE_DEADLINE)
+active_stages: Optional[list[int]] = None
+active_stages_loaded_at = 0.0
+process_errors_orders_ids = []
+delivery_fee_errors_ids = []
+emit_errors_documents_ids = []
+descendant_errors_ids = []
+written_documents_ids = []  # outbox documents whose files are written, not removed from the outbox yet
 reload_file = Path(__file__).with_suffix('.reload')
 constants.jsons_out_path.mkdir(parents=True, exist_ok=True)
-constants.jsons_archive_path.mkdir(parents=True, exist_ok=True)
+json_archive = JsonArchive(constants.jsons_archive_path, retention_days=constants.jsons_archive_retention_days)
+json_writer = JsonWriter(constants.jsons_out_path, json_archive, mode=constants.jsons_out_mode,
+                         index=ArchiveIndex(Session_Sync))
 
 logger.remove()
 logger.add(lambda msg: rich_log.print_log(msg.split('=>')[0]), level='INFO', colorize=True)
@@ -47,89 +82,230 @@ logger.add(sink=lambda msg: send_service_tg_message(msg), format="{time:YYYY-MM-
            level='ERROR')
 
 
-def find_all_tree_orders_any_level(order_dict: dict, crm_orders: list[dict]) -> list[dict]:
-    orders_map = {order['id']: order for order in crm_orders}
-    children_map = {}
-    for order in crm_orders:
-        children_map.setdefault(order['parent_id'], []).append(order['id'])
+def find_root_order_id(order_dict: dict, forest: OrderForest, session: Session) -> int:
+    ancestor_id, is_root = forest.resolve_root(order_dict['id'])
+    if is_root:
+        return ancestor_id
+    root_id = find_root_order_id_via_db(ancestor_id, session)
+    if root_id is None:
+        root_id = find_root_order_id_via_api(ancestor_id, session)
+    forest.set_root(ancestor_id, root_id)
+    return root_id
 
-    result = []
-    stack = [order_dict['id']]
 
-    while stack:
-        curr_node_id = stack.pop()
-        result.append(orders_map[curr_node_id])
+def find_root_order_id_via_db(order_id: int, session: Session) -> Optional[int]:
+    """Walks up the tree over ancestry saved from previous cycles. Returns None if the tree leaves known orders."""
+    while (ancestry := session.get(OrderAncestryDB, order_id)) is not None:
+        if ancestry.root_id is not None:
+            return ancestry.root_id
+        if ancestry.parent_id is None:
+            return ancestry.key_crm_id
+        order_id = ancestry.parent_id
+    return None
 
-        if curr_node_id in children_map:
-            stack.extend(children_map[curr_node_id])
 
-    return result
-
-
-def find_unique_tree_products(tree_orders: list[dict]) -> list[dict]:
-    unique_products = []
-    skus = []
-    for order in tree_orders:
-        for product in order['products']:
-            if product['sku'] not in skus:
-                unique_products.append(product)
-                skus.append(product['sku'])
-    return unique_products
-    
-
-def find_root_order_id(order_dict: dict, crm_orders: list[dict]) -> int:
-    orders_map = {order['id']: order for order in crm_orders}
-    curr_order_id = order_dict['id']
-    while True:
-        if curr_order := orders_map.get(curr_order_id):
-            if curr_order['parent_id'] is None:
-                return curr_order['id']
-            else:
-                curr_order_id = curr_order['parent_id']
-        else:
-            return find_root_order_id_via_api(curr_order_id)
-    
-    
-def find_root_order_id_via_api(order_id: int) -> int:
+def find_root_order_id_via_api(order_id: int, session: Session) -> int:
     order = crm.get_order(order_id)
+    path = []
     while True:
+        path.append(order)
         if order['parent_id'] is None:
-            return order['id']
+            root_id = order['id']
+            break
         else:
             order = crm.get_order(order['parent_id'])
+    for order in path:
+        session.merge(OrderAncestryDB(key_crm_id=order['id'], parent_id=order['parent_id'], root_id=root_id))
+    logger.info(f'Root {root_id} of order {order_id} was found via API in {len(path)} requests')
+    return root_id
 
 
-def normalize_fio(fio: str) -> str:
-    if not IS_PRODUCTION_SERVER:
-        return fio
+def load_ancestry(forest: OrderForest, session: Session) -> None:
+    """Loads ancestry of the parents missing from the batch, so their roots are resolved without API calls."""
+    missing_parent_ids = forest.missing_parent_ids()
+    if not missing_parent_ids:
+        return
+    with session.begin():
+        rows = session.query(OrderAncestryDB).filter(OrderAncestryDB.key_crm_id.in_(missing_parent_ids)).all()
+        for row in rows:
+            if row.root_id is not None:
+                forest.set_root(row.key_crm_id, row.root_id)
 
+
+def find_missing_descendant_ids(forest: OrderForest, batch: OrdersBatch) -> set[int]:
+    """
+    Returns ids of descendants of new root orders of the batch that are not in the batch.
+    A root may get its 'Заказ 1С' flag long after it was split into child orders, then the delta window holds
+    the root only. Descendants are known from the ancestry saved by previous cycles.
+    Cancelled roots don't use tree products, unchanged roots are not processed at all, both are left out.
+    Must run after fingerprints.load() for the batch.
+    """
+    root_ids = set()
+    for order_id, order_dict in forest.orders_map.items():
+        if (order_dict['parent_id'] is not None
+                or order_dict['status_group_id'] == constants.CRM_ORDER_CANCELLED_STAGE_GROUP_ID
+                or get_prefilter_rule(order_dict) is not None
+                or batch.get_order_1c(order_id, Document1C.CLIENT_ORDER) is not None):
+            continue
+        fingerprint = order_fingerprint(order_dict, batch.get_prom_order(order_dict['source_uuid']))
+        if not fingerprints.matches(order_id, fingerprint):
+            root_ids.add(order_id)
+    missing_ids = set()
+    visited_ids = set(root_ids)
+    parent_ids = root_ids
+    while parent_ids:
+        child_ids = {child_id for child_id, in batch.session.query(OrderAncestryDB.key_crm_id)
+                     .filter(OrderAncestryDB.parent_id.in_(parent_ids)).all()} - visited_ids
+        missing_ids.update(child_id for child_id in child_ids if child_id not in forest)
+        visited_ids.update(child_ids)
+        parent_ids = child_ids
+    return missing_ids
+
+
+def get_descendant_order(order_id: int) -> Optional[dict]:
     try:
-        new_fio = ai_reorder_names(fio)
+        order_dict = crm.get_order(order_id)
+        if 'id' not in order_dict:  # e.g. the order was deleted in CRM, the reply is an error body
+            raise LookupError(order_dict)
     except Exception as e:
-        logger.error(f'AI failed to reorder names in {fio} | {str(e)}')
+        if order_id not in descendant_errors_ids:
+            logger.error(f'Failed to get descendant order {order_id} from CRM, skipped | {str(e)}')
+            descendant_errors_ids.append(order_id)
+        return None
+    return order_dict
+
+
+def add_missing_descendants(forest: OrderForest, order_ids: set[int]) -> None:
+    """
+    Fetches the orders from CRM in parallel and adds them to the forest, they are used for tree products only.
+    An order that can't be fetched is skipped.
+    """
+    order_ids = [order_id for order_id in order_ids if order_id not in forest]
+    if not order_ids:
+        return
+    fetched = 0
+    with ThreadPoolExecutor(max_workers=constants.CRM_LOOKUPS_IN_FLIGHT) as executor:
+        for order_dict in executor.map(get_descendant_order, order_ids):
+            if order_dict is not None:
+                forest.add(order_dict)
+                fetched += 1
+    logger.info(f'{fetched} of {len(order_ids)} missing descendants of new root orders were fetched from CRM')
+
+
+def save_ancestry(forest: OrderForest, session: Session) -> None:
+    """Saves parent and root (if known) of every order of the batch."""
+    with session.begin():
+        saved = {row.key_crm_id: row for row in
+                 session.query(OrderAncestryDB).filter(OrderAncestryDB.key_crm_id.in_(forest.orders_map)).all()}
+        for order_id, order in forest.orders_map.items():
+            root_id = forest.root_of(order_id)
+            row = saved.get(order_id)
+            if row is None:
+                session.add(OrderAncestryDB(key_crm_id=order_id, parent_id=order['parent_id'], root_id=root_id))
+            elif row.parent_id != order['parent_id'] or (root_id is not None and row.root_id != root_id):
+                row.parent_id = order['parent_id']
+                row.root_id = root_id
+
+
+def normalize_fio(fio: str) -> str:
+    if not IS_PRODUCTION_SERVER:
         return fio
-    else:
-        if not new_fio:
-            logger.info(f'AI did not recognized proper names in {fio}')
+
+    if fio_stage.is_resolved(fio):  # buyer orders of the cycle, reordered by the FIO stage
+        new_fio = fio_stage.get(fio)
+        if new_fio is None:
+            logger.info(f'AI did not reorder names in {fio} in time, left as is')
             return fio
-        elif new_fio != fio:
-            logger.info(f'AI changed {fio} to {new_fio}')
-            return ' '.join([word.capitalize() for word in new_fio.split(' ')])
-        else:
-            logger.info('AI left name the same')
+    else:
+        new_fio = reorder_names_locally(fio)
+        if new_fio is None:
+            try:
+                new_fio = fio_cache.get(fio)
+            except Exception as e:
+                logger.error(f'FIO cache failed for {fio}, left as is | {str(e)}')
+                return fio
+    if new_fio is None:
+        try:
+            new_fio = ai_reorder_names(fio) or ''
+        except Exception as e:
+            logger.error(f'AI failed to reorder names in {fio} | {str(e)}')
             return fio
+        fio_cache.put(fio, new_fio)
+
+    if not new_fio:
+        logger.info(f'AI did not recognized proper names in {fio} | {fio_cache}')
+        return fio
+    elif new_fio != fio:
+        logger.info(f'AI changed {fio} to {new_fio} | {fio_cache}')
+        return ' '.join([word.capitalize() for word in new_fio.split(' ')])
+    else:
+        logger.info(f'AI left name the same | {fio_cache}')
+        return fio
 
 
 def create_json_file(order: Order1CBuyer | Order1CSupplierPromCommissionOrder | Order1CPostupleniye,
-                     include_keys=None, exclude_keys=None):
-    if type(order) is Order1CBuyer:
-        order.buyer.full_name = normalize_fio(order.buyer.full_name)
-    text = json.dumps(order.model_dump(mode='json', include=include_keys, exclude=exclude_keys),
-                      ensure_ascii=False, indent=4)
-    json_file = f'{order.key_crm_id}_{order.action}_{datetime.now().timestamp()}.json'
-    (constants.jsons_archive_path / json_file).write_text(data=text, encoding='utf-8')
-    (constants.jsons_out_path / json_file).write_text(data=text, encoding='utf-8')
-    logger.info(f'Created JSON file: {json_file} for order: {order.key_crm_id} type: {order.document_type.value}')
+                     batch: OrdersBatch, include_keys=None, exclude_keys=None):
+    """Puts the document to the outbox in the transaction of its order, the file is made by emit_json_files()."""
+    text = json.dumps(order.model_dump(mode='json', include=include_keys, exclude=exclude_keys), ensure_ascii=False)
+    buyer_full_name = order.buyer.full_name if type(order) is Order1CBuyer and order.buyer else None
+    batch.add_document(Json1COutbox(key_crm_id=str(order.key_crm_id), action=order.action,
+                                    document_type=order.document_type.value, document=text,
+                                    buyer_full_name=buyer_full_name))
+
+
+def emit_json_files(session: Session) -> None:
+    """
+    Stages files of the documents waiting in the outbox, buyer names are reordered on the way.
+    Documents stay in the outbox until their files are written (see flush_json_files()), a document that failed
+    is retried in the next cycle, also after a restart.
+    """
+    with session.begin():
+        documents = session.query(Json1COutbox).order_by(Json1COutbox.id).all()
+    in_progress_ids = json_writer.staged_keys.union(written_documents_ids)
+    for document in documents:
+        if document.id in in_progress_ids:
+            continue
+        try:
+            text = document.document
+            if document.buyer_full_name is not None:
+                document_dict = json.loads(text)
+                document_dict['buyer']['full_name'] = normalize_fio(document.buyer_full_name)
+                text = json.dumps(document_dict, ensure_ascii=False)
+        except Exception as e:
+            if document.id not in emit_errors_documents_ids:
+                logger.error(f'Error creating JSON file for order {document.key_crm_id} '
+                             f'type: {document.document_type}, it is retried in the next cycle | {str(e)}')
+                emit_errors_documents_ids.append(document.id)
+            continue
+        json_file = f'{document.key_crm_id}_{document.action}_{datetime.now().timestamp()}.json'
+        json_writer.stage(json_file, text, document.action, key=document.id)  # written by flush_json_files()
+        logger.info(f'Created JSON file: {json_file} for order: {document.key_crm_id} type: {document.document_type}')
+
+
+def remove_written_documents(session: Session) -> None:
+    """Removes documents whose files are written from the outbox; if the db fails, they are removed next time."""
+    written_documents_ids.extend(json_writer.pop_written_keys())
+    if not written_documents_ids:
+        return
+    try:
+        with session.begin():
+            session.query(Json1COutbox).filter(Json1COutbox.id.in_(written_documents_ids)).delete()
+    except Exception as e:
+        logger.error(f'Failed to remove {len(written_documents_ids)} written documents from the outbox | {str(e)}')
+        return
+    written_documents_ids.clear()
+
+
+def flush_json_files(session: Session) -> None:
+    """
+    Writes staged files for 1C and removes their documents from the outbox.
+    A failed write doesn't stop the sync, the files stay staged for the next cycle and their documents in the outbox.
+    """
+    try:
+        json_writer.flush()
+    except Exception as e:
+        logger.error(f'Failed to write JSON files for 1C, they are retried in the next cycle | {str(e)}')
+    remove_written_documents(session)
 
 
 def add_to_track_and_sms(order: Order1CSupplier, old_ttn_number: Optional[str] = None):
@@ -155,23 +331,46 @@ def add_to_track_and_sms(order: Order1CSupplier, old_ttn_number: Optional[str] =
 
 
 def format_date_time(dt: datetime) -> str:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
     return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 
+def parse_crm_date_time(value: str) -> datetime:
+    """KeyCRM returns dates as 'YYYY-MM-DD HH:MM:SS' in UTC."""
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+def get_active_stages() -> list[int]:
+    """Returns ids of not closing stages, the list is cached for CRM_STAGES_CACHE_TTL seconds."""
+    global active_stages, active_stages_loaded_at
+    if active_stages is None or time.monotonic() - active_stages_loaded_at > constants.CRM_STAGES_CACHE_TTL:
+        r = crm_bulk.get_stages()['data']
+        active_stages = [stage_dict['id'] for stage_dict in r if not stage_dict['is_closing_order']]
+        active_stages_loaded_at = time.monotonic()
+    return active_stages
+
+
+def get_stage_orders(stage: int) -> list[dict]:
+    stage_orders = crm_bulk.get_orders(last_orders_amount=0, filter={'status_id': stage})
+    print(f'{len(stage_orders)} orders for stage {stage}\n')
+    return stage_orders
+
+
 @retry(stop_after_delay=120)
 def get_active_orders() -> list:
     """
     Returns list of all active orders from CRM.
     Active orders are orders that are not in closing stages.
+    Stages are swept in parallel, an order that moved between stages during the sweep is returned once.
     """
-    orders = []
-    r = crm.get_stages()['data']
-    active_stages = [stage_dict['id'] for stage_dict in r if not stage_dict['is_closing_order']]
-    for stage in active_stages:
-        stage_orders = crm.get_orders(last_orders_amount=0, filter={'status_id': stage})
-        print(f'{len(stage_orders)} orders for stage {stage}\n')
-        orders += stage_orders
-    return orders
+    orders = {}
+    with ThreadPoolExecutor(max_workers=constants.CRM_STAGE_SWEEPS_IN_FLIGHT) as executor:
+        for stage_orders in executor.map(get_stage_orders, get_active_stages()):
+            for order in stage_orders:
+                orders.setdefault(order['id'], order)
+    return list(orders.values())
 
 
 @retry(stop_after_delay=120)
@@ -204,19 +403,45 @@ def is_order_proper_filled(order: Order1CBuyer) -> bool:
     return order.push_to_1C and order.manager and order.buyer and order.buyer.phone and not order.buyer.has_duplicates
 
 
-def add_order_to_db(order: Order1CBuyer | Order1CSupplier | Order1CSupplierPromCommissionOrder, session: Session) -> bool:
+def get_prefilter_rule(order_dict: dict) -> Optional[str]:
+    """
+    Cheap check of the raw CRM order with the rules of is_order_proper_filled, made before any parsing.
+    Only values that can never pass are rejected, anything doubtful is left to the full validation.
+    :return: the rule the order fails or None if the order has to be parsed
+    """
+    if order_dict['status_group_id'] == constants.CRM_ORDER_CANCELLED_STAGE_GROUP_ID:
+        return None  # cancelled orders are processed even if not properly filled
+    push_to_1C = None
+    for custom_field in order_dict['custom_fields']:
+        if custom_field['name'] == 'Заказ 1С':
+            push_to_1C = custom_field['value']
+    if not push_to_1C:
+        return 'no 1C flag'
+    if not (order_dict['manager'] and manager_key_to_1c.get(order_dict['manager']['id'])):
+        return 'no manager'
+    buyer = order_dict['buyer']
+    if not buyer:
+        return 'no buyer'
+    if not international_phone(buyer['phone']):
+        return 'no buyer phone'
+    if buyer['has_duplicates'] > 0:
+        return 'buyer duplicates'
+    return None
+
+
+def add_order_to_db(order: Order1CBuyer | Order1CSupplier | Order1CSupplierPromCommissionOrder, batch: OrdersBatch) -> bool:
     """
     Adds the order to the database if it doesn't exist yet.
     :param order: The order to add to the database.
     :return: True if the order was added, False if it already existed.
     """
-    if session.query(Order1CDB).filter_by(key_crm_id=order.key_crm_id, document_type=order.document_type).first():
+    if batch.get_order_1c(order.key_crm_id, order.document_type) is not None:
         logger.info(f'Order {order.key_crm_id} type: {order.document_type.value} already exists. Skipping...')
         return False
     if type(order) is Order1CBuyer:
-        session.add(Order1CDB(key_crm_id=order.key_crm_id, document_type=order.document_type))
+        batch.add_order_1c(Order1CDB(key_crm_id=order.key_crm_id, document_type=order.document_type))
     else:
-        session.add(
+        batch.add_order_1c(
             Order1CDB(
                 key_crm_id=order.key_crm_id,
                 parent_id=order.parent_id,
@@ -225,34 +450,36 @@ def add_order_to_db(order: Order1CBuyer | Order1CSupplier | Order1CSupplierPromC
                 supplier_id=order.supplier_id,
             )
         )
-    session.flush()
     logger.info(f'Order: {order.key_crm_id} type: {order.document_type.value} added to db. => {order}')
     return True
 
 
-def process_new_buyer_order(order: Order1CBuyer, session: Session):
-    if add_order_to_db(order, session):
-        create_json_file(order)
+def process_new_buyer_order(order: Order1CBuyer, batch: OrdersBatch):
+    if add_order_to_db(order, batch):
+        if IS_PRODUCTION_SERVER and order.buyer:
+            fio_stage.add(order.buyer.full_name)
+            batch.after_commit(fio_stage.resolve)  # the first call reorders names of the whole chunk at once
+        create_json_file(order, batch)
 
 
-def process_new_supplier_order(order: Order1CSupplier | Order1CSupplierPromCommissionOrder, session: Session):
+def process_new_supplier_order(order: Order1CSupplier | Order1CSupplierPromCommissionOrder, batch: OrdersBatch):
     if order.parent_id is None:
         order.parent_id = order.key_crm_id
-    if add_order_to_db(order, session):
+    if add_order_to_db(order, batch):
         order_copy = order.model_copy(deep=True)
         order_copy.tracking_code = None
         order_copy.supplier_id = None
-        create_json_file(order_copy, exclude_keys={'buyer', 'shipping', 'payment'})
+        create_json_file(order_copy, batch, exclude_keys={'buyer', 'shipping', 'payment'})
 
     if order.tracking_code or order.supplier_id:
         order_update = order.model_copy(deep=True)
         order_update.action = 'update_supplier_order'
-        create_json_file(order_update, include_keys={'action', 'key_crm_id', 'tracking_code', 'supplier_id'})
+        create_json_file(order_update, batch, include_keys={'action', 'key_crm_id', 'tracking_code', 'supplier_id'})
         if order.tracking_code:
             add_to_track_and_sms(order=order)
 
 
-def process_existing_supplier_order(order: Order1CSupplierUpdate, db_order: Order1CDB):
+def process_existing_supplier_order(order: Order1CSupplierUpdate, db_order: Order1CDB, batch: OrdersBatch):
     updated = False
     if order.tracking_code and order.tracking_code != db_order.tracking_code:  # order tracking code is new or changed
         add_to_track_and_sms(order=order, old_ttn_number=db_order.tracking_code)
@@ -262,11 +489,11 @@ def process_existing_supplier_order(order: Order1CSupplierUpdate, db_order: Orde
         db_order.supplier_id = order.supplier_id
         updated = True
     if updated:
-        create_json_file(order, include_keys={'action', 'key_crm_id', 'tracking_code', 'supplier_id'})
+        create_json_file(order, batch, include_keys={'action', 'key_crm_id', 'tracking_code', 'supplier_id'})
 
 
-def make_supplier_comission_orders(buyer_order: Order1CBuyer, session: Session):
-    prom_order = session.query(PromOrderDB).filter_by(order_id=buyer_order.source_uuid).first()
+def make_supplier_comission_orders(buyer_order: Order1CBuyer, batch: OrdersBatch):
+    prom_order = batch.get_prom_order(buyer_order.source_uuid)
     if prom_order is not None:  # if order at Prom orders
         if prom_order.cpa_commission > 0:  # if order has CPA commission
             commission_order = Order1CSupplierPromCommissionOrder(
@@ -276,8 +503,8 @@ def make_supplier_comission_orders(buyer_order: Order1CBuyer, session: Session):
                 products=[ProductCommissionProSale(price=prom_order.cpa_commission)],
                 shop=prom_order.shop,
             )
-            process_new_supplier_order(commission_order, session)
-            make_postupleniye_for_commission_order(commission_order, session)
+            process_new_supplier_order(commission_order, batch)
+            make_postupleniye_for_commission_order(commission_order, batch)
 
         if prom_order.order_commission > 0:  # if order has order commission
             commission_order = Order1CSupplierPromCommissionOrder(
@@ -287,30 +514,30 @@ def make_supplier_comission_orders(buyer_order: Order1CBuyer, session: Session):
                 products=[ProductCommissionProSaleForOrder(price=prom_order.order_commission)],
                 shop=prom_order.shop,
             )
-            process_new_supplier_order(commission_order, session)
-            make_postupleniye_for_commission_order(commission_order, session)
+            process_new_supplier_order(commission_order, batch)
+            make_postupleniye_for_commission_order(commission_order, batch)
 
 
-def make_postupleniye_for_commission_order(commission_order: Order1CSupplierPromCommissionOrder, session: Session):
+def make_postupleniye_for_commission_order(commission_order: Order1CSupplierPromCommissionOrder, batch: OrdersBatch):
     postupleniye = Order1CPostupleniye(
         key_crm_id=commission_order.key_crm_id,
         parent_id=commission_order.key_crm_id,
         supplier=commission_order.supplier,
         products=commission_order.products,
     )
-    if add_order_to_db(postupleniye, session):
-        create_json_file(postupleniye)
+    if add_order_to_db(postupleniye, batch):
+        create_json_file(postupleniye, batch)
 
 
-def make_vozvrat_tovarov_for_commission_posupleniye(prom_cpa_refund: PromCPARefundOutbox, session: Session):
+def make_vozvrat_tovarov_for_commission_posupleniye(prom_cpa_refund: PromCPARefundOutbox, batch: OrdersBatch):
     return_tovarov = Order1CReturnTovarov(
         key_crm_id=str(prom_cpa_refund.order_id),
         parent_id=str(prom_cpa_refund.order_id),
         supplier=f'Просейл {prom_cpa_refund.shop}',
         products=[ProductCommissionProSale(price=prom_cpa_refund.cpa_commission)],
     )
-    if add_order_to_db(return_tovarov, session):
-        create_json_file(return_tovarov)
+    if add_order_to_db(return_tovarov, batch):
+        create_json_file(return_tovarov, batch)
 
 
 def update_crm_order(order: Order1CBuyer):
@@ -336,8 +563,8 @@ def is_prom_order_cancelled_and_has_order_commission(prom_order: PromOrderDB) ->
     return prom_order.status == PromStatus.CANCELLED and prom_order.order_commission > 0 
 
 
-def check_and_process_unreturned_commission(order: Order1CBuyer, order_dict: dict, session: Session) -> None:
-    prom_order = session.query(PromOrderDB).filter_by(order_id=order.source_uuid).first()
+def check_and_process_unreturned_commission(order: Order1CBuyer, crm_order: CrmOrder, batch: OrdersBatch) -> None:
+    prom_order = batch.get_prom_order(order.source_uuid)
     if prom_order is None:  
         return
         
@@ -353,14 +580,14 @@ def check_and_process_unreturned_commission(order: Order1CBuyer, order_dict: dic
         order.proveden = True
         msg = f'Заказ для учёта комиссии за заказ пром и (возможно) невозвращенной комиссии по просейл по заказу {prom_order.shop}: {order.source_uuid}'
         order.manager_comment = f'{order.manager_comment}\n{msg}' if order.manager_comment else msg
-        process_new_buyer_order(order, session)
+        process_new_buyer_order(order, batch)
         
-        supplier_order = Order1CSupplier(**order_dict)
+        supplier_order = crm_order.to_supplier()
         supplier_order.products = [FakeProductSupplier()]
         supplier_order.supplier = FAKE_SUPPLIER
         supplier_order.tracking_code = TTN_SENT_BY_CAR
         supplier_order.send_sms = False
-        process_new_supplier_order(supplier_order, session)
+        process_new_supplier_order(supplier_order, batch)
         
         commission_order = Order1CSupplierPromCommissionOrder(
             key_crm_id=f'{prom_order.order_id}',
@@ -369,97 +596,260 @@ def check_and_process_unreturned_commission(order: Order1CBuyer, order_dict: dic
             products=products,
             shop=prom_order.shop,
         )
-        process_new_supplier_order(commission_order, session)
-        make_postupleniye_for_commission_order(commission_order, session)
+        process_new_supplier_order(commission_order, batch)
+        make_postupleniye_for_commission_order(commission_order, batch)
+
+
+def get_watermark(session: Session) -> SyncWatermarkDB:
+    with session.begin():
+        watermark = session.get(SyncWatermarkDB, CRM_WATERMARK_NAME)
+        if watermark is None:
+            watermark = SyncWatermarkDB(name=CRM_WATERMARK_NAME)
+            session.add(watermark)
+    return watermark
+
+
+def is_full_sweep_due(watermark: SyncWatermarkDB, now: datetime) -> bool:
+    return (watermark.updated_at is None or watermark.full_sweep_at is None or
+            now - watermark.full_sweep_at > timedelta(minutes=constants.CRM_FULL_SWEEP_EVERY_MINUTES))
+
+
+def save_watermark(watermark: SyncWatermarkDB, crm_orders: list[dict], session: Session, *,
+                   now: datetime, end: datetime, full_sweep: bool) -> None:
+    """
+    Moves the watermark to the latest updated_at among processed orders.
+    updated_at is KeyCRM server time, so the watermark never depends on the local clock,
+    except when there were no orders at all.
+    """
+    updated_at = max((parse_crm_date_time(order['updated_at']) for order in crm_orders), default=None)
+    with session.begin():
+        if updated_at is not None:
+            updated_at = min(updated_at, end)
+            if watermark.updated_at is None or updated_at > watermark.updated_at:
+                watermark.updated_at = updated_at
+        elif watermark.updated_at is None:
+            watermark.updated_at = now
+        if full_sweep:
+            watermark.full_sweep_at = now
+        session.add(watermark)
 
 
 def main():
-    start_time = datetime.now(timezone.utc) - timedelta(minutes=constants.CRM_MINUTES_INTERVAL_TO_CHECK)
-    with redirect_stdout(rich_log.console_to_rich_log_redirector):
-        crm_orders = get_interval_orders(start=start_time)
-    # crm_orders = get_interval_orders(start=datetime(year=2025, month=7, day=1, tzinfo=timezone.utc), filter_on='created') 
-    # crm_orders = get_active_orders() + get_orders_by_stage()
-    if len(crm_orders) > constants.CRM_MAX_PROCESSING_ORDERS:
-        logger.error(f'Too many orders (more than {constants.CRM_MAX_PROCESSING_ORDERS}) to process in CRM')
-    with Session_Sync() as session:
-        process_orders(crm_orders, session)
-        process_cpa_refunds(session)
-        process_delivery_fees(session)
-
-
-def process_orders(crm_orders: list[dict], session: Session):
-    for order_dict in crm_orders:
-        with session.begin():
-            try:
-                order = Order1CBuyer(**order_dict)
-            except Exception as e:
-                if order_dict['id'] not in parse_errors_orders_ids:
-                    logger.error(f'Error parsing order {order_dict['id']}: {e} ')
-                    parse_errors_orders_ids.append(order_dict['id'])
-                continue
+    with Session_Sync(expire_on_commit=False) as session:
+        watermark = get_watermark(session)
+        now = datetime.now(timezone.utc)
+        full_sweep = is_full_sweep_due(watermark, now)
+        start_time = None
+        if watermark.updated_at is not None:
+            start_time = watermark.updated_at - timedelta(seconds=constants.CRM_WATERMARK_OVERLAP_SECONDS)
+        if full_sweep:  # never starts after the watermark, e.g. after a downtime longer than the sweep window
+            sweep_start_time = now - timedelta(minutes=constants.CRM_MINUTES_INTERVAL_TO_CHECK)
+            start_time = sweep_start_time if start_time is None else min(start_time, sweep_start_time)
+        end_time = now + timedelta(seconds=constants.CRM_CLOCK_SKEW_SECONDS)
+        with redirect_stdout(rich_log.console_to_rich_log_redirector):
+            crm_orders = get_interval_orders(start=start_time, end=end_time)
+        # crm_orders = get_interval_orders(start=datetime(year=2025, month=7, day=1, tzinfo=timezone.utc), filter_on='created') 
+        # crm_orders = get_active_orders() + get_orders_by_stage()
+        if len(crm_orders) > constants.CRM_MAX_PROCESSING_ORDERS:
+            logger.error(f'Too many orders (more than {constants.CRM_MAX_PROCESSING_ORDERS}) to process in CRM')
+        batch = OrdersBatch(session)
+        try:
+            process_orders(crm_orders, batch)
+            save_watermark(watermark, crm_orders, session, now=now, end=end_time, full_sweep=full_sweep)
+            process_cpa_refunds(batch)
+            process_delivery_fees(batch)
+            emit_json_files(session)
+        finally:
+            flush_json_files(session)
+
+
+def process_orders(crm_orders: list[dict], batch: OrdersBatch):
+    session = batch.session
+    forest = OrderForest(crm_orders)
+    parsed_orders.clear()
+    prefiltered.clear()
+    fio_stage.start_cycle()
+    load_ancestry(forest, session)
+    with session.begin():
+        batch.prefetch(key_crm_ids=forest.orders_map,
+                       source_uuids=[order_dict['source_uuid'] for order_dict in crm_orders])
+        fingerprints.load(session, forest.orders_map)
+        source_uuid_index.add_orders(session, crm_orders)
+        missing_descendant_ids = find_missing_descendant_ids(forest, batch)
+    add_missing_descendants(forest, missing_descendant_ids)
+    hits, misses = fingerprints.hits, fingerprints.misses
+    chunk_size = constants.CRM_ORDERS_PER_TRANSACTION
+    for chunk_start in range(0, len(crm_orders), chunk_size):
+        with batch.transaction():
+            for order_dict in crm_orders[chunk_start:chunk_start + chunk_size]:
+                fingerprint = order_fingerprint(order_dict, batch.get_prom_order(order_dict['source_uuid']))
+                if fingerprints.is_unchanged(order_dict['id'], fingerprint):
+                    continue  # nothing that matters to 1C changed since the order was processed
+                try:
+                    with batch.order_scope():
+                        if process_order(order_dict, forest, batch):
+                            batch.after_commit(partial(fingerprints.remember, order_dict['id'], fingerprint))
+                except Exception as e:
+                    if order_dict['id'] not in process_errors_orders_ids:
+                        logger.error(f'Error processing order {order_dict['id']}, its changes are rolled back: {e}')
+                        process_errors_orders_ids.append(order_dict['id'])
+        emit_json_files(session)
+        flush_json_files(session)  # files of committed orders don't wait for the whole cycle
+    save_ancestry(forest, session)
+    with session.begin():
+        fingerprints.save(session)
+    rich_log.print_request(f'{len(crm_orders)} orders: {fingerprints.hits - hits} unchanged skipped, '
+                           f'{fingerprints.misses - misses} processed, '
+                           f'{prefiltered.total()} rejected before parsing {dict(prefiltered)} | '
+                           f'fingerprints total hits: {fingerprints.hits} misses: {fingerprints.misses} | '
+                           f'{fio_stage} | {fio_cache}')
+
 
-            if not is_order_proper_filled(order) and not is_order_cancelled(order):
-                continue  # skip some not properly filled orders
-
-            if not order.parent_id:  # it is Buyer order and POSSIBLY Supplier order
-                db_order = session.query(Order1CDB).filter_by(key_crm_id=order.key_crm_id, parent_id=None).first()
-                if db_order is None:  # if order doesn't exist in db
-                    if is_order_cancelled(order):
-                        check_and_process_unreturned_commission(order, order_dict, session)
-                        continue
-                    # if order.prices_rounded: # uncomment when CRM fixes update
-                    #     update_crm_order(order)
-                    tree_orders = find_all_tree_orders_any_level(order_dict, crm_orders)
-                    tree_products = find_unique_tree_products(tree_orders)
-                    extended_order = order.model_copy(deep=True)
-                    extended_order.products = [ProductBuyer(**product) for product in tree_products]
-                    process_new_buyer_order(extended_order, session)
-                    make_supplier_comission_orders(order, session)   # untab this line to process unprocessed commissions
-
-            if order.supplier:   # Supplier present, this is a Supplier order or also a Supplier order
-                order = Order1CSupplier(**order_dict)
-                db_order = session.query(Order1CDB).filter(Order1CDB.key_crm_id == order.key_crm_id,
-                                                           Order1CDB.parent_id.isnot(None)).first()
-                if db_order is None:  # if order doesn't exist in db
-                    root_id = find_root_order_id(order_dict, crm_orders)
-                    order.parent_id = str(root_id)
-                    process_new_supplier_order(order=order, session=session)
-                else:  # if order exists in db
-                    order = Order1CSupplierUpdate(**order_dict)
-                    process_existing_supplier_order(order=order, db_order=db_order)
-
-
-def process_cpa_refunds(session: Session):
+def process_order(order_dict: dict, forest: OrderForest, batch: OrdersBatch) -> bool:
+    """
+    Creates or updates 1C documents for one CRM order.
+    :return: False if the order could not be parsed, True otherwise.
+    """
+    rule = get_prefilter_rule(order_dict)
+    if rule:
+        prefiltered[rule] += 1
+        return True  # never processable, skipped as not properly filled without parsing
+
+    try:
+        crm_order = parse_order(order_dict)
+    except Exception as e:
+        if order_dict['id'] not in parse_errors_orders_ids:
+            logger.error(f'Error parsing order {order_dict['id']}: {e} ')
+            parse_errors_orders_ids.append(order_dict['id'])
+        return False
+    order = crm_order.to_buyer()
+
+    if not is_order_proper_filled(order) and not is_order_cancelled(order):
+        return True  # skip some not properly filled orders
+
+    if not order.parent_id:  # it is Buyer order and POSSIBLY Supplier order
+        db_order = batch.get_order_1c(order.key_crm_id, Document1C.CLIENT_ORDER)
+        if db_order is None:  # if order doesn't exist in db
+            if is_order_cancelled(order):
+                check_and_process_unreturned_commission(order, crm_order, batch)
+                return True
+            # if order.prices_rounded: # uncomment when CRM fixes update
+            #     update_crm_order(order)
+            extended_order = crm_order.to_buyer()
+            extended_order.products = get_tree_products(order_dict['id'], forest)
+            process_new_buyer_order(extended_order, batch)
+            make_supplier_comission_orders(order, batch)   # untab this line to process unprocessed commissions
+
+    if order.supplier:   # Supplier present, this is a Supplier order or also a Supplier order
+        order = crm_order.to_supplier()
+        db_order = batch.get_order_1c(order.key_crm_id, Document1C.SUPPLIER_ORDER)
+        if db_order is None:  # if order doesn't exist in db
+            root_id = find_root_order_id(order_dict, forest, batch.session)
+            order.parent_id = str(root_id)
+            process_new_supplier_order(order=order, batch=batch)
+        else:  # if order exists in db
+            order = crm_order.to_supplier_update()
+            process_existing_supplier_order(order=order, db_order=db_order, batch=batch)
+    return True
+
+
+def parse_order(order_dict: dict) -> CrmOrder:
+    """Normalizes a CRM order once per cycle, the 1C orders are derived from the result."""
+    crm_order = parsed_orders.get(order_dict['id'])
+    if crm_order is None:
+        crm_order = parsed_orders[order_dict['id']] = CrmOrder(order_dict)
+    return crm_order
+
+
+def get_tree_products(order_id: int, forest: OrderForest) -> list[ProductBuyer]:
+    """Products of the order and all its descendants normalized like their orders, first occurrence of every sku wins."""
+    products = []
+    skus = set()
+    for order_dict in forest.subtree(order_id):
+        try:
+            order_products = parse_order(order_dict).buyer_products()
+        except Exception:  # the child order itself is reported when it is processed
+            order_products = [ProductBuyer(**product) for product in order_dict['products']]
+        for product in order_products:
+            if product.sku not in skus:
+                products.append(product)
+                skus.add(product.sku)
+    return products
+
+
+def process_cpa_refunds(batch: OrdersBatch):
+    session = batch.session
     with session.begin():
         all_cpa_refunds = session.query(PromCPARefundOutbox).all()
     for cpa_refund in all_cpa_refunds:
-        with session.begin():
+        with batch.transaction():
             q = session.query(Order1CDB).filter_by(key_crm_id=str(cpa_refund.order_id)).first()
             if q is not None:
-                make_vozvrat_tovarov_for_commission_posupleniye(cpa_refund, session)
+                make_vozvrat_tovarov_for_commission_posupleniye(cpa_refund, batch)
                 session.delete(cpa_refund)
 
 
-def process_delivery_fees(session: Session):
+def get_key_crm_id_via_api(source_uuid: str) -> Optional[int]:
+    try:
+        order = crm.get_order_by_source_uuid(source_uuid, include=None)
+    except Exception as e:
+        logger.error(f'Failed to get order from CRM for {source_uuid} | {str(e)}')
+        return None
+    if order is None:
+        logger.error(f'Failed to get order from CRM for {source_uuid} | order not found')
+        return None
+    return order['id']
+
+
+def get_key_crm_ids_via_api(source_uuids: list[str]) -> dict[str, int]:
+    """Looks up orders in CRM in parallel, one small request without includes per source_uuid."""
+    with ThreadPoolExecutor(max_workers=constants.CRM_LOOKUPS_IN_FLIGHT) as executor:
+        key_crm_ids = dict(zip(source_uuids, executor.map(get_key_crm_id_via_api, source_uuids)))
+    return {source_uuid: key_crm_id for source_uuid, key_crm_id in key_crm_ids.items() if key_crm_id is not None}
+
+
+def process_delivery_fees(batch: OrdersBatch):
+    """
+    Drains the delivery commission outbox in one go: CRM ids are taken from the source_uuid index,
+    only unknown ones are requested from CRM, then all commission documents are created in one transaction.
+    """
+    session = batch.session
     with session.begin():
         records = session.query(PromDeliveryCommissionOutbox).all()
-    for record in records:
-        with session.begin():
+        if not records:
+            return
+        key_crm_ids = source_uuid_index.get_many(session, [record.order_id for record in records])
+        batch.prefetch(key_crm_ids=[f'{record.order_id}_fd' for record in records], source_uuids=[])
+
+    found_via_api = get_key_crm_ids_via_api([str(record.order_id) for record in records
+                                             if str(record.order_id) not in key_crm_ids])
+    key_crm_ids.update(found_via_api)
+    logger.info(f'Got CRM orders for {len(key_crm_ids)} of {len(records)} delivery commissions '
+                f'({len(found_via_api)} via API)')
+
+    with batch.transaction():
+        if found_via_api:
+            source_uuid_index.add_many(session, found_via_api)
+        for record in records:
+            key_crm_id = key_crm_ids.get(str(record.order_id))
+            if key_crm_id is None:
+                continue
             try:
-                crm_reply = crm.get_orders(filter={"source_uuid": str(record.order_id)})[0]
-                logger.info(f'Successfully got order from CRM for {record.order_id}')
+                with batch.order_scope():
+                    commission_order = Order1CSupplierPromCommissionOrder(
+                        key_crm_id=f'{record.order_id}_fd',  # fd = free delivery
+                        parent_id=str(key_crm_id),
+                        supplier=f'Просейл {record.shop}',
+                        products=[ProductCommissionProSaleFreeDelivery(price=record.delivery_commission)],
+                        shop=record.shop)
+                    process_new_supplier_order(commission_order, batch)
+                    make_postupleniye_for_commission_order(commission_order, batch)
+                    session.delete(record)
             except Exception as e:
-                logger.error(f'Failed to get order from CRM for {record.order_id} | {str(e)}')
-                continue
-            commission_order = Order1CSupplierPromCommissionOrder(
-                key_crm_id=f'{record.order_id}_fd',  # fd = free delivery
-                parent_id=str(crm_reply['id']),
-                supplier=f'Просейл {record.shop}',
-                products=[ProductCommissionProSaleFreeDelivery(price=record.delivery_commission)],
-                shop=record.shop)
-            process_new_supplier_order(commission_order, session)
-            make_postupleniye_for_commission_order(commission_order, session)
-            session.delete(record)
+                if record.order_id not in delivery_fee_errors_ids:
+                    logger.error(f'Error processing delivery commission of order {record.order_id}, '
+                                 f'it stays in the outbox: {e}')
+                    delivery_fee_errors_ids.append(record.order_id)
 
 
 if __name__ == '__main__':
@@ -478,4 +868,10 @@ if __name__ == '__main__':
     except Exception as e:
         logger.error(f'Error in {__file__}: {e}')
     finally:
+        try:
+            json_writer.close()
+        except Exception as e:
+            logger.error(f'Failed to write JSON files for 1C on shutdown, they stay in the outbox | {str(e)}')
+        with Session_Sync() as session:
+            remove_written_documents(session)
         rich_log.stop()
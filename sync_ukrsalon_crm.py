@@ -1,9 +1,10 @@
 from contextlib import redirect_stdout
 import constants
 from api.insales_api import Insales
-from api.key_crm_api import KeyCRM
+from api.key_crm_api import KeyCRM, Priority
 from db.db_init import Session_Sync
 from db.models import UkrsalonOrderDB
+from db.source_uuid_index import SourceUuidIndex
 from parse.parse_insales_order import OrderInsales
 from parse.parse_constants import Status, ukrsalon_crm_id, insta_ukrsalon_crm_id
 from messengers import send_tg_message, send_service_tg_message
@@ -13,7 +14,8 @@ from retry import retry
 from tools.rich_log import RichLog
 
 ukrsalon = Insales(constants.UKRSALON_URL)
-crm = KeyCRM(constants.CRM_API_KEY)
+crm = KeyCRM(constants.CRM_API_KEY, priority=Priority.HIGH)  # new orders go before the sync sweeps
+source_uuid_index = SourceUuidIndex()
 rich_log = RichLog(header=f'Синхронизация Укрсалона с CRM       {__file__}')
 
 reload_file = Path(__file__).with_suffix('.reload')
@@ -98,10 +100,15 @@ def main() -> None:
                 if crm_reply.get('errors', {}).get('source_uuid', [''])[0] == 'The source uuid has already been taken.':
                     logger.info(f'Error inserting order {order.source_uuid} to CRM: The source uuid has already been taken. Trying to get order from CRM...')
                     try:
-                        crm_reply = crm.get_orders(filter={"source_uuid": order_dict['number']})[0]
+                        key_crm_id = source_uuid_index.resolve(session, crm, order_dict['number'])
+                        if key_crm_id is None:
+                            raise LookupError(f'No order with source_uuid {order_dict["number"]} in CRM')
+                        crm_reply = {'id': key_crm_id}
                         logger.info(f'Successfully got id {order.source_uuid} from CRM')
                     except:
                         logger.error(f'Error getting id {order.source_uuid} from CRM => {crm_reply}')
+                elif 'id' in crm_reply:
+                    source_uuid_index.add(session, order.source_uuid, crm_reply['id'])
                 session.add(UkrsalonOrderDB(source_uuid=order.source_uuid,
                                             insales_id=order.insales_id,
                                             key_crm_id=crm_reply['id'],
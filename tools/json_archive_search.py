@@ -0,0 +1,73 @@
+"""
+Finds archived 1C documents through the archived_documents index.
+
+Run from the repository root:
+    python -m tools.json_archive_search order 12345 [--action create_supplier_order]
+    python -m tools.json_archive_search range 2025-07-01 2025-07-02T12:00 [--action ...] [--list]
+    python -m tools.json_archive_search reindex    # index loose files and segments already in the archive
+"""
+import argparse
+import json
+from datetime import datetime
+from pathlib import Path
+
+import constants
+from db.archive_index import ArchiveIndex
+from db.db_init import Session_Sync
+from db.models import ArchivedDocumentDB
+from json_archive import SEGMENT_SUFFIX, ArchiveLocation, JsonArchive
+
+REINDEX_BATCH = 1000
+
+
+def read_document(archive: JsonArchive, row: ArchivedDocumentDB) -> dict | list:
+    if row.segment is None:
+        return json.loads((archive.archive_path / row.file_name).read_text(encoding='utf-8'))
+    return archive.read(ArchiveLocation(row.segment, row.member_offset, row.line))['document']
+
+
+def reindex(archive: JsonArchive, index: ArchiveIndex) -> None:
+    loose_files = [(file.name, None) for file in archive.archive_path.glob('*.json')]
+    indexed = 0
+    for start in range(0, len(loose_files), REINDEX_BATCH):
+        indexed += index.add(loose_files[start:start + REINDEX_BATCH])
+    for segment in sorted(archive.archive_path.glob(f'*{SEGMENT_SUFFIX}')):
+        for offset, records in archive.iter_members(segment.name):
+            indexed += index.add([(record['file'], ArchiveLocation(segment.name, offset, line))
+                                  for line, record in enumerate(records)])
+    print(f'Indexed {indexed} documents')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find archived 1C documents')
+    parser.add_argument('--path', type=Path, default=constants.jsons_archive_path)
+    commands = parser.add_subparsers(dest='command', required=True)
+    order = commands.add_parser('order', help='documents of a CRM order')
+    order.add_argument('key_crm_id')
+    time_range = commands.add_parser('range', help='documents created in [start, end)')
+    time_range.add_argument('start', type=datetime.fromisoformat)
+    time_range.add_argument('end', type=datetime.fromisoformat)
+    for command in (order, time_range):
+        command.add_argument('--action', help='e.g. create_buyer_order')
+        command.add_argument('--list', action='store_true', help='only list the documents')
+    commands.add_parser('reindex', help='index the documents already in the archive')
+    args = parser.parse_args()
+
+    archive = JsonArchive(args.path)
+    index = ArchiveIndex(Session_Sync)
+    if args.command == 'reindex':
+        reindex(archive, index)
+        return
+    if args.command == 'order':
+        rows = index.find(key_crm_id=args.key_crm_id, action=args.action)
+    else:
+        rows = index.find(start=args.start.astimezone(), end=args.end.astimezone(), action=args.action)
+    for row in rows:
+        print(row)
+        if not args.list:
+            print(json.dumps(read_document(archive, row), ensure_ascii=False, indent=4))
+    print(f'{len(rows)} documents')
+
+
+if __name__ == '__main__':
+    main()
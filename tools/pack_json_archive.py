@@ -0,0 +1,58 @@
+"""
+Packs loose JSON files of the archive into daily segments of JsonArchive, moves their index records
+to the segments and removes the files.
+Files are grouped by the day of the timestamp in their name and appended in time order.
+
+Run from the repository root: python -m tools.pack_json_archive [--dry-run] [--batch 1000]
+"""
+import argparse
+import json
+from collections import defaultdict
+from pathlib import Path
+
+import constants
+from db.archive_index import ArchiveIndex
+from db.db_init import Session_Sync
+from json_archive import JsonArchive, parse_file_name
+
+
+def loose_files_by_day(archive_path: Path) -> dict:
+    days = defaultdict(list)
+    for file in archive_path.glob('*.json'):
+        try:
+            timestamp = parse_file_name(file.name).created_at
+        except ValueError:
+            print(f'Skipped {file.name}: not a document file name')
+            continue
+        days[timestamp.date()].append((timestamp, file))
+    return days
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack loose JSON archive files into daily gzip segments')
+    parser.add_argument('--path', type=Path, default=constants.jsons_archive_path)
+    parser.add_argument('--batch', type=int, default=1000, help='files per gzip member')
+    parser.add_argument('--dry-run', action='store_true', help='only count the files')
+    args = parser.parse_args()
+
+    archive = JsonArchive(args.path)  # no retention here, the sync process applies it
+    index = ArchiveIndex(Session_Sync)
+    days = loose_files_by_day(args.path)
+    for day in sorted(days):
+        files = [file for _, file in sorted(days[day])]
+        print(f'{day}: {len(files)} files')
+        if args.dry_run:
+            continue
+        for start in range(0, len(files), args.batch):
+            chunk = files[start:start + args.batch]
+            locations = archive.append([(file.name, json.dumps(json.loads(file.read_text(encoding='utf-8')),
+                                                               ensure_ascii=False)) for file in chunk], day=day)
+            index.add([(file.name, location) for file, location in zip(chunk, locations)])
+            for file in chunk:  # removed only after their segment member is written
+                file.unlink()
+    print(f'{"Found" if args.dry_run else "Packed"} {sum(len(files) for files in days.values())} files '
+          f'for {len(days)} segments')
+
+
+if __name__ == '__main__':
+    main()